@@ -0,0 +1,115 @@
+"""
+Analítica de fallas del historial (NumPy, vectorizado).
+Sin dependencias de Streamlit ni del almacenamiento: recibe los arreglos que arma HistoryStore.
+"""
+from datetime import date
+
+import numpy as np
+
+# CAST(julianday(día) AS INTEGER) - JULIAN_DAY_OFFSET = date.toordinal()
+JULIAN_DAY_OFFSET = 1721424
+
+
+def _safe_ratio(num, den):
+    return np.divide(num, den, out=np.full(len(num), np.nan), where=den > 0)
+
+
+def compute_failure_analytics(insts, fails, daily, titles: dict, top_n: int = 50):
+    """
+    insts: conteos por instalación (id, comm, name, cat, ok, fail; ver HistoryStore.installation_totals)
+    fails: días (julianos) con FALLA por instalación (inst, day; ver HistoryStore.fail_days)
+    daily: conteos diarios por comunidad (day, comm, ok, fail, pending; ver HistoryStore.daily_totals)
+    Calcula tasa de falla por instalación / tipo / edificio, MTBF, rachas de FALLA y
+    tendencia diaria con operaciones de arreglo (sin recorrer ítem por ítem).
+    """
+    if len(insts) == 0:
+        return None
+
+    k = len(insts)
+    inst_fail = insts["fail"].astype(float)
+    inst_checks = (insts["ok"] + insts["fail"]).astype(float)
+    rate = _safe_ratio(inst_fail, inst_checks)
+
+    # comunidades codificadas en común para instalaciones y conteos diarios
+    comms, comm_code = np.unique(np.concatenate([insts["comm"], daily["comm"]]).astype(str), return_inverse=True)
+    inst_comm, day_comm = comm_code[:k], comm_code[k:]
+
+    # episodios de falla: FALLA cuyo día anterior no fue FALLA en la misma instalación
+    order = np.argsort(insts["id"])
+    pos = order[np.searchsorted(insts["id"], fails["inst"], sorter=order)]
+    srt = np.lexsort((fails["day"], pos))
+    f_inst, f_day = pos[srt], fails["day"][srt]
+    continues = (f_inst[1:] == f_inst[:-1]) & (np.diff(f_day) == 1)
+    starts = np.r_[True, ~continues] if len(f_inst) else np.zeros(0, dtype=bool)
+    start_idx = np.flatnonzero(starts)
+
+    # MTBF (días) = promedio de días entre inicios de episodios de la misma instalación
+    s_inst, s_day = f_inst[start_idx], f_day[start_idx]
+    same = s_inst[1:] == s_inst[:-1]
+    mtbf = _safe_ratio(
+        np.bincount(s_inst[1:][same], weights=np.diff(s_day)[same], minlength=k),
+        np.bincount(s_inst[1:][same], minlength=k).astype(float),
+    )
+
+    # rachas: largo de cada episodio; la actual es la que llega al último día con datos de su edificio
+    run_len = np.bincount(np.cumsum(starts) - 1, minlength=len(start_idx))
+    run_last_day = s_day + run_len - 1
+    max_streak = np.zeros(k, dtype=np.int64)
+    np.maximum.at(max_streak, s_inst, run_len)
+    comm_last_day = np.zeros(len(comms), dtype=np.int64)
+    np.maximum.at(comm_last_day, day_comm, daily["day"])
+    ongoing = run_last_day == comm_last_day[inst_comm[s_inst]]
+    current_streak = np.zeros(k, dtype=np.int64)
+    current_streak[s_inst[ongoing]] = run_len[ongoing]
+
+    top = np.lexsort((-inst_fail, -np.nan_to_num(rate, nan=-1.0)))[:top_n]
+    installations = {
+        "Comunidad": [titles.get(c, c) for c in insts["comm"][top]],
+        "Instalación": insts["name"][top].tolist(),
+        "Tipo": [c or "Sin tipo" for c in insts["cat"][top]],
+        "Revisiones": inst_checks[top].astype(int).tolist(),
+        "Fallas": inst_fail[top].astype(int).tolist(),
+        "Tasa falla %": np.round(rate[top] * 100, 1).tolist(),
+        "MTBF (días)": np.round(mtbf[top], 1).tolist(),
+        "Racha máx.": max_streak[top].tolist(),
+        "Racha actual": current_streak[top].tolist(),
+    }
+
+    # por tipo y por edificio: sumas de las instalaciones
+    cats, cat_code = np.unique(insts["cat"].astype(str), return_inverse=True)
+    c_fail = np.bincount(cat_code, weights=inst_fail, minlength=len(cats))
+    c_checks = np.bincount(cat_code, weights=inst_checks, minlength=len(cats))
+    b_fail = np.bincount(inst_comm, weights=inst_fail, minlength=len(comms))
+    b_checks = np.bincount(inst_comm, weights=inst_checks, minlength=len(comms))
+    b_rate = _safe_ratio(b_fail, b_checks)
+    rank = np.argsort(-np.nan_to_num(b_rate, nan=-1.0), kind="stable")
+    rank = rank[b_checks[rank] > 0]
+
+    # tendencia diaria desde los conteos diarios preagregados
+    days, day_code = np.unique(daily["day"], return_inverse=True)
+    d_fail = np.bincount(day_code, weights=daily["fail"], minlength=len(days))
+    d_checks = np.bincount(day_code, weights=daily["ok"] + daily["fail"], minlength=len(days))
+
+    return {
+        "checks": int(inst_checks.sum()),
+        "fails": int(inst_fail.sum()),
+        "episodes": int(len(start_idx)),
+        "installations": installations,
+        "trend": {
+            "Día": [date.fromordinal(int(d) - JULIAN_DAY_OFFSET) for d in days],
+            "Tasa falla %": np.round(_safe_ratio(d_fail, d_checks) * 100, 1).tolist(),
+        },
+        "categories": {
+            "Tipo": [c or "Sin tipo" for c in cats.tolist()],
+            "Revisiones": c_checks.astype(int).tolist(),
+            "Fallas": c_fail.astype(int).tolist(),
+            "Tasa falla %": np.round(_safe_ratio(c_fail, c_checks) * 100, 1).tolist(),
+        },
+        "buildings": {
+            "Ranking": list(range(1, len(rank) + 1)),
+            "Comunidad": [titles.get(c, c) for c in comms[rank]],
+            "Revisiones": b_checks[rank].astype(int).tolist(),
+            "Fallas": b_fail[rank].astype(int).tolist(),
+            "Tasa falla %": np.round(b_rate[rank] * 100, 1).tolist(),
+        },
+    }
@@ -1,6 +1,18 @@
 import streamlit as st
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
 from datetime import datetime, date
+from http.server import ThreadingHTTPServer
 from io import BytesIO
+from pathlib import Path
 
 from PIL import Image
 
@@ -19,6 +31,19 @@ from docx.shared import Inches
 from openpyxl import Workbook, load_workbook
 from openpyxl.worksheet.datavalidation import DataValidation
 
+from analytics import compute_failure_analytics
+from ingest import STATUS_ALIASES, make_ingest_handler
+from planning import (
+    CATEGORIES, DEFAULT_INSTALLATIONS, FREQUENCIES, PLAN_MONTHLY_DAY, PLAN_WEEKLY_WEEKDAY,
+    Checklist, MasterCache, MasterCatalog, Planner,
+)
+from shared import ITEM_SHARED_FIELDS, SharedInspection, SharedStore
+from storage import (
+    ArchiveStore, HistoryStore, PhotoStore, archive_old_inspections, normalize_key,
+)
+
+
+logger = logging.getLogger(__name__)
 
 st.set_page_config(
     page_title="Control Edificio Pro (Streamlit)",
@@ -26,85 +51,45 @@ st.set_page_config(
     layout="wide",
 )
 
-# ---------------------------
-# Master data (defaults)
-# ---------------------------
-CATEGORIES = ["Críticos", "Accesos", "Higiene", "Comunes", "Infra"]
+# Datos locales (fotos, etc.); CONTROL_EDIFICIO_DATA permite moverlos
+DATA_DIR = Path(os.environ.get("CONTROL_EDIFICIO_DATA", "data"))
+PHOTO_DIR = DATA_DIR / "photos"
+HISTORY_DB = DATA_DIR / "historial.db"
+SEARCH_PAGE_SIZE = 20
 
-DEFAULT_INSTALLATIONS = [
-    {"Tipo": "Críticos", "Instalación": "Sala de Bombas", "Tarea": "Presión y alternancia"},
-    {"Tipo": "Críticos", "Instalación": "Sala de Calderas", "Tarea": "Temperatura y fugas"},
-    {"Tipo": "Críticos", "Instalación": "Generador", "Tarea": "Nivel petróleo y batería"},
-    {"Tipo": "Críticos", "Instalación": "PEAS (Presurización)", "Tarea": "Prueba de ventilador"},
-    {"Tipo": "Críticos", "Instalación": "Ascensores (2)", "Tarea": "Nivelación y limpieza rieles"},
-    {"Tipo": "Accesos", "Instalación": "Portones (2)", "Tarea": "Sensores y velocidad"},
-    {"Tipo": "Accesos", "Instalación": "Control Biométrico", "Tarea": "Lectores huella/tarjeta"},
-    {"Tipo": "Higiene", "Instalación": "Sala de Basura", "Tarea": "Desinfección y contenedores"},
-    {"Tipo": "Higiene", "Instalación": "Ductos (20 pisos)", "Tarea": "Cierre de escotillas"},
-    {"Tipo": "Comunes", "Instalación": "Piscina", "Tarea": "Parámetros Cl/pH"},
-    {"Tipo": "Comunes", "Instalación": "Quincho / Eventos", "Tarea": "Mobiliario e higiene"},
-    {"Tipo": "Comunes", "Instalación": "Gym / Sauna", "Tarea": "Máquinas y tableros"},
-    {"Tipo": "Infra", "Instalación": "Pasillos (1-20)", "Tarea": "Luces de emergencia"},
-    {"Tipo": "Infra", "Instalación": "Subterráneo", "Tarea": "Filtraciones y limpieza"},
-    {"Tipo": "Infra", "Instalación": "Jardines", "Tarea": "Riego programado"},
-]
+# Archivo: los meses completos más antiguos que ARCHIVE_AFTER_DAYS se compactan en un ZIP por mes.
+# CONTROL_EDIFICIO_ARCHIVE permite dejarlo en otro disco; CONTROL_EDIFICIO_ARCHIVE_DAYS=0 lo desactiva
+ARCHIVE_DIR = Path(os.environ.get("CONTROL_EDIFICIO_ARCHIVE", DATA_DIR / "archive"))
+ARCHIVE_AFTER_DAYS = int(os.environ.get("CONTROL_EDIFICIO_ARCHIVE_DAYS", "90"))
 
+# Nombres de los días para describir la planificación en la UI (ver planning.py)
+WEEKDAY_NAMES = ["lunes", "martes", "miércoles", "jueves", "viernes", "sábados", "domingos"]
 
-# ---------------------------
-# Helpers (State)
-# ---------------------------
-def build_checklist_items_from_master(master_rows):
-    """
-    master_rows: list of dicts with keys Tipo, Instalación, Tarea (optional)
-    Builds session checklist item dicts (id, cat, name, task, status, note, photo)
-    """
-    items = []
-    next_id = 1
-    for r in master_rows:
-        cat = (r.get("Tipo") or "").strip()
-        name = (r.get("Instalación") or "").strip()
-        task = (r.get("Tarea") or "").strip() or "—"
-
-        if not cat or not name:
-            continue
+# Analítica: segundos que se reutiliza un cálculo y filas del ranking de instalaciones
+ANALYTICS_CACHE_SECONDS = 60
+ANALYTICS_TOP_N = 50
 
-        # Normaliza cat a las categorías permitidas si viene con variantes
-        if cat not in CATEGORIES:
-            # Si viene "Espacio Común" etc., intenta mapear a Comunes
-            mapped = map_tipo_to_category(cat)
-            cat = mapped
+# Informes: sobre este tamaño el archivo temporal se vuelca a disco; lado mayor de las fotos incluidas
+EXPORT_SPOOL_MAX_BYTES = 8 * 1024 * 1024
+REPORT_PHOTO_MAX_PX = 1200
 
-        items.append({
-            "id": next_id,
-            "cat": cat,
-            "name": name,
-            "task": task,
-            "status": "pending",
-            "note": "",
-            "photo": None,
-        })
-        next_id += 1
+# API local de ingesta (POST /api/inspecciones); CONTROL_EDIFICIO_API=0 la desactiva
+INGEST_API_ENABLED = os.environ.get("CONTROL_EDIFICIO_API", "1") != "0"
+INGEST_API_HOST = os.environ.get("CONTROL_EDIFICIO_API_HOST", "127.0.0.1")
+INGEST_API_PORT = int(os.environ.get("CONTROL_EDIFICIO_API_PORT", "8765"))
 
-    return items
+# Inspección compartida: cada cuánto revisa cambios cada sesión (ver shared.py)
+SHARED_POLL_SECONDS = 3
 
 
-def map_tipo_to_category(tipo: str) -> str:
+# ---------------------------
+# Helpers (State)
+# ---------------------------
+def build_checklist_items_from_master(master_rows):
     """
-    Mapea 'Tipo' libre a una categoría soportada.
+    Builds the session checklist: shared (cached) master catalog + empty per-session overlays
     """
-    t = (tipo or "").strip().lower()
-    if "crit" in t:
-        return "Críticos"
-    if "infra" in t:
-        return "Infra"
-    if "comun" in t or "común" in t or "espacio" in t:
-        return "Comunes"
-    if "hig" in t or "aseo" in t or "basura" in t:
-        return "Higiene"
-    if "acces" in t or "port" in t:
-        return "Accesos"
-    # fallback
-    return "Comunes"
+    return Checklist(get_master_cache().catalog_for_rows(master_rows))
 
 
 def init_state():
@@ -124,6 +109,41 @@ def init_state():
     if "needs" not in st.session_state:
         st.session_state["needs"] = ""
 
+    if "session_id" not in st.session_state:
+        st.session_state["session_id"] = uuid.uuid4().hex
+
+    # inspección compartida a la que está enlazada la sesión y último delta aplicado
+    if "shared_bound" not in st.session_state:
+        st.session_state["shared_bound"] = None
+        st.session_state["shared_seq"] = 0
+        st.session_state["needs_version"] = 0
+        st.session_state["shared_conflicts"] = []
+
+    # estado de widgets con key (se inicializa aquí para no pasar value= junto al Session State API)
+    st.session_state.setdefault("community_input", st.session_state["community_name"])
+    st.session_state.setdefault("report_date_input", st.session_state["report_date"])
+    st.session_state.setdefault("needs_input", st.session_state["needs"])
+
+
+# ---------------------------
+# Datos maestros compartidos (solo lectura) + estado por sesión + fotos
+# ---------------------------
+@st.cache_resource
+def get_master_cache() -> MasterCache:
+    return MasterCache()
+
+
+@st.cache_resource
+def get_photo_store() -> PhotoStore:
+    return PhotoStore(PHOTO_DIR)
+
+
+def photo_bytes(ref):
+    """
+    Contenido de la foto referenciada por un ítem (None si no tiene).
+    """
+    return get_photo_store().get(ref)
+
 
 # ---------------------------
 # Helpers (UI/Stats/Text)
@@ -199,24 +219,25 @@ def build_report_text():
 def export_master_template_bytes() -> bytes:
     """
     Crea plantilla XLSX para Datos Maestros:
-    Columnas: Tipo, Instalación, Tarea (opcional)
-    Tipo tiene validación (dropdown) con categorías soportadas.
+    Columnas: Tipo, Instalación, Tarea (opcional), Frecuencia (opcional, por defecto Diaria)
+    Tipo y Frecuencia tienen validación (dropdown) con los valores soportados.
     """
     wb = Workbook()
     ws = wb.active
     ws.title = "DatosMaestros"
 
-    headers = ["Tipo", "Instalación", "Tarea"]
+    headers = ["Tipo", "Instalación", "Tarea", "Frecuencia"]
     ws.append(headers)
 
     # precarga con defaults (si el usuario quiere usarlos)
     for r in DEFAULT_INSTALLATIONS:
-        ws.append([r.get("Tipo", ""), r.get("Instalación", ""), r.get("Tarea", "")])
+        ws.append([r.get("Tipo", ""), r.get("Instalación", ""), r.get("Tarea", ""), r.get("Frecuencia", "Diaria")])
 
     # Ajustes simples
     ws.column_dimensions["A"].width = 18
     ws.column_dimensions["B"].width = 32
     ws.column_dimensions["C"].width = 34
+    ws.column_dimensions["D"].width = 14
 
     # Validación de datos (dropdown) en Tipo
     allowed = ",".join(CATEGORIES)
@@ -226,6 +247,11 @@ def export_master_template_bytes() -> bytes:
     # Aplica validación a un rango “amplio” (por si agregan filas)
     dv.add("A2:A500")
 
+    # Validación de datos (dropdown) en Frecuencia
+    dv_freq = DataValidation(type="list", formula1=f'"{",".join(FREQUENCIES)}"', allow_blank=True)
+    ws.add_data_validation(dv_freq)
+    dv_freq.add("D2:D500")
+
     # Guarda a bytes
     bio = BytesIO()
     wb.save(bio)
@@ -233,10 +259,10 @@ def export_master_template_bytes() -> bytes:
     return bio.getvalue()
 
 
-def import_master_from_xlsx(uploaded_file_bytes: bytes):
+def parse_master_xlsx(uploaded_file_bytes: bytes) -> list:
     """
-    Lee XLSX y reemplaza checklist_items por lo que venga en la hoja DatosMaestros (o la primera hoja).
-    Espera columnas: Tipo, Instalación, (Tarea opcional).
+    Lee la hoja DatosMaestros (o la primera hoja) y retorna las filas maestras.
+    Espera columnas: Tipo, Instalación, (Tarea y Frecuencia opcionales).
     """
     bio = BytesIO(uploaded_file_bytes)
     wb = load_workbook(bio, data_only=True)
@@ -262,6 +288,7 @@ def import_master_from_xlsx(uploaded_file_bytes: bytes):
     i_tipo = idx("Tipo")
     i_inst = idx("Instalación")
     i_task = idx("Tarea")  # opcional
+    i_freq = idx("Frecuencia")  # opcional
 
     if i_tipo is None or i_inst is None:
         raise ValueError("La plantilla debe incluir columnas 'Tipo' y 'Instalación'.")
@@ -273,19 +300,53 @@ def import_master_from_xlsx(uploaded_file_bytes: bytes):
         tipo = (r[i_tipo] if i_tipo < len(r) else "") or ""
         inst = (r[i_inst] if i_inst < len(r) else "") or ""
         task = (r[i_task] if (i_task is not None and i_task < len(r)) else "") or ""
+        freq = (r[i_freq] if (i_freq is not None and i_freq < len(r)) else "") or ""
         tipo = str(tipo).strip()
         inst = str(inst).strip()
         task = str(task).strip()
+        freq = str(freq).strip()
 
         if not tipo or not inst:
             continue
 
-        master.append({"Tipo": tipo, "Instalación": inst, "Tarea": task})
+        master.append({"Tipo": tipo, "Instalación": inst, "Tarea": task, "Frecuencia": freq})
 
     if not master:
         raise ValueError("No se encontraron registros válidos (Tipo + Instalación).")
 
-    st.session_state["checklist_items"] = build_checklist_items_from_master(master)
+    return master
+
+
+def import_master_from_xlsx(uploaded_file_bytes: bytes):
+    """
+    Reemplaza los datos maestros de la comunidad por la plantilla XLSX. El parseo se cachea
+    por archivo y el catálogo resultante se comparte entre sesiones (ver MasterCache).
+    """
+    apply_master(get_master_cache().catalog_for_xlsx(uploaded_file_bytes, parse_master_xlsx))
+
+
+# ---------------------------
+# Export (archivo temporal para informes grandes)
+# ---------------------------
+def new_export_spool():
+    """
+    Archivo temporal que se mantiene en memoria hasta EXPORT_SPOOL_MAX_BYTES
+    y sobre ese tamaño se vuelca a disco (se borra solo al cerrarlo).
+    """
+    return tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES, mode="w+b")
+
+
+def spool_download_data(spool) -> bytes:
+    """
+    Entrega el contenido del archivo temporal a st.download_button (que necesita el archivo completo)
+    y lo cierra. Se llama sólo en el rerun en que se pidió la descarga: la copia que guarda
+    Streamlit para el botón se libera en el siguiente rerun, y la sesión no retiene nada más.
+    """
+    try:
+        spool.seek(0)
+        return spool.read()
+    finally:
+        spool.close()
 
 
 # ---------------------------
@@ -312,6 +373,8 @@ def _make_rl_image(photo_bytes: bytes, max_w: float, max_h: float, small_style):
     scale = min(max_w / iw, max_h / ih)
     w, h = iw * scale, ih * scale
 
+    # se incrusta reducida: el tamaño del PDF no depende de la resolución de la cámara
+    img.thumbnail((REPORT_PHOTO_MAX_PX, REPORT_PHOTO_MAX_PX))
     buf = BytesIO()
     img.save(buf, format="JPEG", quality=85)
     buf.seek(0)
@@ -320,7 +383,10 @@ def _make_rl_image(photo_bytes: bytes, max_w: float, max_h: float, small_style):
     return RLImage(buf, width=w, height=h)
 
 
-def generate_pdf_bytes_visual() -> bytes:
+def generate_pdf_visual():
+    """
+    Genera el PDF visual en un archivo temporal (ver new_export_spool) y lo retorna posicionado al inicio.
+    """
     styles = getSampleStyleSheet()
 
     normal = ParagraphStyle(
@@ -357,9 +423,9 @@ def generate_pdf_bytes_visual() -> bytes:
         spaceAfter=6,
     )
 
-    buffer = BytesIO()
+    spool = new_export_spool()
     doc = SimpleDocTemplate(
-        buffer,
+        spool,
         pagesize=A4,
         leftMargin=1.2 * cm,
         rightMargin=1.2 * cm,
@@ -447,7 +513,7 @@ def generate_pdf_bytes_visual() -> bytes:
                 normal,
             )
 
-            img_cell = _make_rl_image(it.get("photo"), photo_max_w, photo_max_h, small)
+            img_cell = _make_rl_image(photo_bytes(it.get("photo")), photo_max_w, photo_max_h, small)
             data.append([inst, mid, img_cell])
 
             if it["status"] == "fail":
@@ -492,14 +558,17 @@ def generate_pdf_bytes_visual() -> bytes:
             elements.append(Paragraph(f"- <b>{ts}</b> | <b>{inc['employee']}</b>: {inc['detail']}", normal))
 
     doc.build(elements)
-    buffer.seek(0)
-    return buffer.getvalue()
+    spool.seek(0)
+    return spool
 
 
 # ---------------------------
 # Word (texto + anexo fotos, mantiene tu versión actual)
 # ---------------------------
-def generate_docx_bytes(report_text: str) -> bytes:
+def generate_docx(report_text: str):
+    """
+    Genera el Word en un archivo temporal (ver new_export_spool) y lo retorna posicionado al inicio.
+    """
     doc = Document()
     doc.add_heading("Informe de Gestión / Control de Instalaciones", level=1)
 
@@ -518,55 +587,593 @@ def generate_docx_bytes(report_text: str) -> bytes:
             note = (it.get("note") or "").strip()
             doc.add_paragraph(f"Obs: {note}" if note else "Obs: (sin observaciones)")
 
-            img = Image.open(BytesIO(it["photo"])).convert("RGB")
+            try:
+                img = Image.open(BytesIO(photo_bytes(it["photo"]))).convert("RGB")
+            except Exception:
+                doc.add_paragraph("(Foto inválida)")
+                continue
+            img.thumbnail((REPORT_PHOTO_MAX_PX, REPORT_PHOTO_MAX_PX))
             img_buf = BytesIO()
-            img.save(img_buf, format="PNG")
+            img.save(img_buf, format="JPEG", quality=85)
+            img.close()
             img_buf.seek(0)
 
             doc.add_picture(img_buf, width=Inches(5.8))
+            img_buf.close()
             doc.add_paragraph("")
 
-    out = BytesIO()
-    doc.save(out)
-    out.seek(0)
-    return out.getvalue()
+    spool = new_export_spool()
+    doc.save(spool)
+    spool.seek(0)
+    return spool
+
+
+# ---------------------------
+# Historial persistente (SQLite + FTS5; ver storage.py)
+# ---------------------------
+@st.cache_resource
+def get_history_store() -> HistoryStore:
+    return HistoryStore(HISTORY_DB, get_archive_store(), get_photo_store())
+
+
+# ---------------------------
+# Planificación (frecuencia por instalación)
+# ---------------------------
+@st.cache_resource
+def get_planner() -> Planner:
+    return Planner(get_history_store(), get_master_cache())
+
+
+@st.cache_resource
+def ensure_daily_plans(day_iso: str) -> int:
+    """
+    Una vez por proceso y por día: deja planificados los próximos PLAN_HORIZON_DAYS días.
+    """
+    return get_planner().plan_days(date.fromisoformat(day_iso))
+
+
+# ---------------------------
+# Archivo (almacenamiento frío por mes)
+# ---------------------------
+@st.cache_resource
+def get_archive_store() -> ArchiveStore:
+    return ArchiveStore(ARCHIVE_DIR)
+
+
+def _archive_in_background(today: date):
+    try:
+        summary = archive_old_inspections(
+            get_history_store(), get_archive_store(), get_photo_store(), today, ARCHIVE_AFTER_DAYS
+        )
+        logger.info("Archivo: %d inspecciones de %s; %d fotos liberadas.",
+                    summary["inspections"], summary["months"], summary["photos_removed"])
+    except Exception:
+        logger.exception("Falló el archivo de inspecciones antiguas.")
+
+
+@st.cache_resource
+def ensure_archived(day_iso: str):
+    """
+    Una vez por proceso y por día, en segundo plano (recomprimir fotos puede tardar).
+    """
+    if ARCHIVE_AFTER_DAYS <= 0:
+        return None
+    thread = threading.Thread(
+        target=_archive_in_background, args=(date.fromisoformat(day_iso),), name="archiver", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+# ---------------------------
+# Analítica de fallas (NumPy, vectorizado)
+# ---------------------------
+@st.cache_data(ttl=ANALYTICS_CACHE_SECONDS, show_spinner=False)
+def load_failure_analytics(since: date, community: str = ""):
+    """
+    since se alinea al primer día del mes para que los conteos mensuales por instalación calcen exacto.
+    """
+    since = since.replace(day=1)
+    history = get_history_store()
+    return compute_failure_analytics(
+        history.installation_totals(since.isoformat()[:7], community),
+        history.fail_days(since.isoformat(), community),
+        history.daily_totals(since.isoformat(), community),
+        history.community_titles(),
+        top_n=ANALYTICS_TOP_N,
+    )
+
+
+# ---------------------------
+# Inspección compartida (varias sesiones / guardias sobre el mismo edificio)
+# ---------------------------
+@st.cache_resource
+def get_shared_store() -> SharedStore:
+    return SharedStore(get_photo_store(), get_history_store(), get_planner().building_catalog)
+
+
+# ---------------------------
+# API local de ingesta (BMS / CMMS; ver ingest.py)
+# ---------------------------
+@st.cache_resource
+def start_ingest_api(host: str, port: int):
+    """
+    Levanta la API local una sola vez por proceso (hilo en segundo plano junto a Streamlit).
+    Si el puerto está ocupado, la app sigue funcionando sin API.
+    """
+    try:
+        server = ThreadingHTTPServer((host, port), make_ingest_handler(get_shared_store()))
+    except OSError:
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="ingest-api", daemon=True).start()
+    return server
+
+
+# ---------------------------
+# Sincronización sesión <-> inspección compartida
+# ---------------------------
+def current_inspection() -> SharedInspection:
+    return get_shared_store().inspection(st.session_state["community_name"], st.session_state["report_date"])
+
+
+def set_local_item(it, fields: dict):
+    """
+    Actualiza un ítem de la sesión y el estado de sus widgets (el widget manda sobre el dict en el render).
+    Sólo se puede llamar antes de dibujar el checklist (inicio del script o callbacks).
+    """
+    for f, v in fields.items():
+        it[f] = v
+        if f in ("status", "note"):
+            st.session_state[f"{f}_{it['id']}"] = v
+
+
+def _load_inspection_snapshot(insp: SharedInspection):
+    st.session_state["checklist_items"] = get_planner().day_checklist(
+        st.session_state["community_name"], st.session_state["report_date"]
+    )
+    snap = insp.snapshot()
+    for it in st.session_state["checklist_items"]:
+        cur = snap["items"].get(normalize_key(it["name"]))
+        if cur is None:
+            set_local_item(it, {"status": "pending", "note": "", "photo": None})
+            it["version"] = 0
+        else:
+            set_local_item(it, {f: cur[f] for f in ITEM_SHARED_FIELDS})
+            it["version"] = cur["version"]
+
+    st.session_state["incidences"] = snap["incidences"]
+    st.session_state["needs"] = snap["needs"]
+    st.session_state["needs_input"] = snap["needs"]
+    st.session_state["needs_version"] = snap["needs_version"]
+    st.session_state["shared_bound"] = (insp.community, insp.day, insp.epoch)
+    st.session_state["shared_seq"] = snap["seq"]
+
+
+def sync_shared_inspection(in_fragment: bool = False):
+    """
+    Trae a la sesión lo que cambiaron otras sesiones (o la API) desde el último rerun.
+    Al cambiar de comunidad/fecha (o si el feed ya no alcanza) se carga el snapshot completo;
+    en régimen normal sólo se aplican los deltas.
+    in_fragment: se llama desde el fragmento del checklist, que sólo puede tocar sus propios
+    widgets; si hay algo más que aplicar (snapshot, incidencias, requerimientos) pide un rerun completo.
+    """
+    insp = current_inspection()
+    seq, deltas = insp.changes_since(st.session_state["shared_seq"])
+    if st.session_state["shared_bound"] != (insp.community, insp.day, insp.epoch) or deltas is None:
+        if in_fragment:
+            st.rerun()
+        _load_inspection_snapshot(insp)
+        return
+
+    me = st.session_state["session_id"]
+    if in_fragment and any(d["kind"] != "item" and d["by"] != me for d in deltas):
+        st.rerun()
+    by_key = {normalize_key(it["name"]): it for it in st.session_state["checklist_items"]}
+    for d in deltas:
+        if d["by"] == me:
+            continue
+        if d["kind"] == "item":
+            it = by_key.get(d["key"])
+            if it is not None:
+                set_local_item(it, d["fields"])
+                it["version"] = max(it.get("version", 0), d["version"])
+        elif d["kind"] == "inc_add":
+            st.session_state["incidences"].append(d["fields"])
+        elif d["kind"] == "inc_del":
+            st.session_state["incidences"] = [x for x in st.session_state["incidences"] if x["id"] != d["key"]]
+        elif d["kind"] == "needs":
+            st.session_state["needs"] = d["fields"]["needs"]
+            st.session_state["needs_input"] = d["fields"]["needs"]
+            st.session_state["needs_version"] = d["version"]
+
+    st.session_state["shared_seq"] = seq
+
+
+def push_item_fields(it, fields: dict):
+    """
+    Publica en la inspección compartida los campos que la sesión cambió en un ítem.
+    Si otro guardia modificó el mismo campo antes, gana su valor y se avisa en pantalla.
+    La sesión adopta la versión vigente junto con todos sus valores: si sólo tomara la versión,
+    un campo que otro cambió y la sesión aún no ve dejaría de detectarse como conflicto.
+    """
+    version, current, conflicts = current_inspection().write_item(
+        normalize_key(it["name"]), it["name"], fields, it.get("version", 0), st.session_state["session_id"],
+        cat=it["cat"], task=it["task"],
+    )
+    set_local_item(it, current)
+    it["version"] = version
+    if conflicts:
+        labels = {"status": "estado", "note": "observación", "photo": "foto"}
+        st.session_state["shared_conflicts"].append(
+            f"{it['name']}: otro usuario cambió {', '.join(labels[f] for f in conflicts)} antes; se mantuvo su valor."
+        )
+
+
+def on_item_widget_change(item_id: int, field: str):
+    it = next((x for x in st.session_state["checklist_items"] if x["id"] == item_id), None)
+    if it is None:
+        return
+    value = st.session_state.get(f"{field}_{item_id}")
+    if field == "photo":
+        if value is None:
+            return
+        value = get_photo_store().put(value.getvalue())
+    it[field] = value
+    push_item_fields(it, {field: value})
+
+
+def on_mark_all(status: str):
+    for it in st.session_state["checklist_items"]:
+        if it["status"] != status:
+            set_local_item(it, {"status": status})
+            push_item_fields(it, {"status": status})
+
+
+def on_inspection_key_change():
+    st.session_state["community_name"] = st.session_state.get("community_input", st.session_state["community_name"])
+    st.session_state["report_date"] = st.session_state.get("report_date_input", st.session_state["report_date"])
+
+
+def on_needs_change():
+    text = st.session_state["needs_input"]
+    version, current, conflict = current_inspection().write_needs(
+        text, st.session_state["needs_version"], st.session_state["session_id"]
+    )
+    st.session_state["needs_version"] = version
+    st.session_state["needs"] = current
+    if conflict:
+        st.session_state["needs_input"] = current
+        st.session_state["shared_conflicts"].append("Requerimientos: otro usuario los modificó antes; se mantuvo su texto.")
+
+
+def add_incidence(employee: str, detail: str):
+    inc = current_inspection().add_incidence(employee, detail, datetime.now(), st.session_state["session_id"])
+    st.session_state["incidences"].append(inc)
+
+
+def delete_incidence(inc_id: int):
+    current_inspection().delete_incidence(inc_id, st.session_state["session_id"])
+    st.session_state["incidences"] = [x for x in st.session_state["incidences"] if x["id"] != inc_id]
+
+
+def invalidate_shared_sync():
+    """
+    Fuerza recargar el snapshot en el próximo rerun (p. ej. tras cambiar los datos maestros).
+    """
+    st.session_state["shared_bound"] = None
+
+
+def apply_master(catalog: MasterCatalog):
+    """
+    Nuevos datos maestros para la comunidad actual: se guardan, se replanifican y la sesión
+    recarga el checklist del día en el próximo rerun.
+    """
+    get_planner().save_master(st.session_state["community_name"], catalog, date.today())
+    st.session_state["checklist_items"] = Checklist(catalog)
+    invalidate_shared_sync()
+
+
+def _fragment(run_every):
+    deco = getattr(st, "fragment", None) or st.experimental_fragment
+    return deco(run_every=run_every)
+
+
+def show_shared_conflicts():
+    for msg in st.session_state["shared_conflicts"]:
+        st.warning(msg)
+    st.session_state["shared_conflicts"] = []
+
+
+@st.cache_resource(max_entries=256)
+def photo_preview(ref: str):
+    """
+    Miniatura para mostrar en el checklist (la ref es el hash del contenido: nunca queda desactualizada).
+    """
+    data = photo_bytes(ref)
+    try:
+        img = Image.open(BytesIO(data)).convert("RGB")
+        img.thumbnail((480, 480))
+        buf = BytesIO()
+        img.save(buf, format="JPEG", quality=80)
+        return buf.getvalue()
+    except Exception:
+        return data
+
+
+# ---------------------------
+# Respaldo (snapshot) de la inspección: ZIP con manifiesto JSON + fotos por hash
+# ---------------------------
+SNAPSHOT_FORMAT = "control-edificio-snapshot"
+SNAPSHOT_VERSION = 1
+
+
+def export_inspection_snapshot(insp: SharedInspection, catalog: MasterCatalog):
+    """
+    Escribe la inspección completa (datos maestros, ítems, incidencias, requerimientos) en un ZIP:
+    manifest.json compacto + cada foto una sola vez en photos/<sha256>. Las fotos se copian
+    desde el disco por bloques y el ZIP se arma en un archivo temporal (ver new_export_spool).
+    """
+    snap = insp.snapshot()
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "community": insp.title,
+        "date": insp.day,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "master": catalog.rows(),
+        "items": [
+            {k: it[k] for k in ("name", "cat", "task", "status", "note", "photo")}
+            for it in snap["items"].values()
+        ],
+        "incidences": [
+            {"employee": inc["employee"], "detail": inc["detail"], "ts": inc["ts"].isoformat(timespec="seconds")}
+            for inc in snap["incidences"]
+        ],
+        "needs": snap["needs"],
+    }
+
+    photos = get_photo_store()
+    spool = new_export_spool()
+    with zipfile.ZipFile(spool, "w") as zf:
+        zf.writestr(
+            "manifest.json",
+            json.dumps(manifest, ensure_ascii=False, separators=(",", ":")),
+            compress_type=zipfile.ZIP_DEFLATED,
+        )
+        # JPEG/PNG ya vienen comprimidas: se guardan tal cual
+        for ref in sorted({it["photo"] for it in manifest["items"] if it["photo"]}):
+            path = photos.path(ref)
+            if path.exists():
+                zf.write(path, f"photos/{ref}", compress_type=zipfile.ZIP_STORED)
+    spool.seek(0)
+    return spool
+
+
+def _snapshot_text(value, what: str, required: bool = False) -> str:
+    if value is None:
+        value = ""
+    if not isinstance(value, str):
+        raise ValueError(f"{what} debe ser texto.")
+    if required and not value.strip():
+        raise ValueError(f"Falta {what}.")
+    return value.strip() if required else value
+
+
+def parse_snapshot_manifest(manifest) -> dict:
+    """
+    Valida el manifiesto completo antes de escribir nada (un respaldo dañado no se restaura a medias)
+    y lo deja normalizado: {community, date, master, items, incidences, needs}.
+    Lanza ValueError con el detalle si algo no es válido.
+    """
+    if not isinstance(manifest, dict):
+        raise ValueError("manifest.json debe ser un objeto JSON.")
+    if manifest.get("format") != SNAPSHOT_FORMAT or manifest.get("version") != SNAPSHOT_VERSION:
+        raise ValueError("Formato de respaldo no soportado.")
+
+    community = _snapshot_text(manifest.get("community"), "la comunidad", required=True)
+    try:
+        day = date.fromisoformat(manifest["date"])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("El respaldo no indica una fecha válida.")
+
+    raw_master = manifest.get("master") or []
+    raw_items = manifest.get("items") or []
+    raw_incs = manifest.get("incidences") or []
+    if not all(isinstance(x, list) for x in (raw_master, raw_items, raw_incs)):
+        raise ValueError("'master', 'items' e 'incidences' deben ser listas.")
+
+    master = []
+    for n, r in enumerate(raw_master, start=1):
+        if not isinstance(r, dict):
+            raise ValueError(f"master[{n}]: debe ser un objeto.")
+        master.append({k: _snapshot_text(r.get(k), f"master[{n}].{k}")
+                       for k in ("Tipo", "Instalación", "Tarea", "Frecuencia")})
+
+    items = []
+    for n, it in enumerate(raw_items, start=1):
+        if not isinstance(it, dict):
+            raise ValueError(f"items[{n}]: debe ser un objeto.")
+        status = STATUS_ALIASES.get(_snapshot_text(it.get("status") or "pending", f"items[{n}].status").lower())
+        if status is None:
+            raise ValueError(f"items[{n}]: estado inválido '{it['status']}'.")
+        photo = it.get("photo")
+        if photo is not None and (not isinstance(photo, str) or re.fullmatch(r"[0-9a-f]{64}", photo) is None):
+            raise ValueError(f"items[{n}]: 'photo' debe ser la referencia (sha256) de una foto.")
+        items.append({
+            "name": _snapshot_text(it.get("name"), f"items[{n}].name", required=True),
+            "cat": _snapshot_text(it.get("cat"), f"items[{n}].cat") or None,
+            "task": _snapshot_text(it.get("task"), f"items[{n}].task") or None,
+            "status": status,
+            "note": _snapshot_text(it.get("note"), f"items[{n}].note"),
+            "photo": photo,
+        })
+
+    incidences = []
+    for n, inc in enumerate(raw_incs, start=1):
+        if not isinstance(inc, dict):
+            raise ValueError(f"incidences[{n}]: debe ser un objeto.")
+        try:
+            ts = datetime.fromisoformat(inc.get("ts"))
+        except (TypeError, ValueError):
+            raise ValueError(f"incidences[{n}]: 'ts' debe ser fecha ISO 8601.")
+        incidences.append({
+            "employee": _snapshot_text(inc.get("employee"), f"incidences[{n}].employee", required=True),
+            "detail": _snapshot_text(inc.get("detail"), f"incidences[{n}].detail", required=True),
+            # el manifiesto guarda la hora al segundo: se compara igual (en memoria puede traer microsegundos)
+            "ts": ts.replace(microsecond=0),
+        })
+
+    return {
+        "community": community,
+        "date": day,
+        "master": master,
+        "items": items,
+        "incidences": incidences,
+        "needs": _snapshot_text(manifest.get("needs"), "'needs'"),
+    }
+
+
+def import_inspection_snapshot(fileobj) -> dict:
+    """
+    Restaura un respaldo sobre la inspección compartida de su comunidad y fecha.
+    El manifiesto y las fotos se validan antes de escribir en la inspección. Las fotos que ya
+    existen en el almacén no se vuelven a copiar; las nuevas se leen por bloques y se verifica
+    su hash. Retorna un resumen (comunidad, fecha, conteos).
+    """
+    with zipfile.ZipFile(fileobj) as zf:
+        try:
+            raw = zf.read("manifest.json")
+        except KeyError:
+            raise ValueError("El archivo no contiene manifest.json.")
+        try:
+            manifest = json.loads(raw.decode("utf-8"))
+        except ValueError:
+            raise ValueError("manifest.json no es JSON válido.")
+        snap = parse_snapshot_manifest(manifest)
+
+        photos = get_photo_store()
+        copied = 0
+        for name in zf.namelist():
+            if not name.startswith("photos/"):
+                continue
+            ref = name.split("/", 1)[1]
+            if photos.has(ref):
+                continue
+            with zf.open(name) as src:
+                if photos.put_stream(src) != ref:
+                    raise ValueError(f"La foto {ref[:12]}… está dañada (hash distinto).")
+            copied += 1
+
+    insp = get_shared_store().inspection(snap["community"], snap["date"])
+    by = st.session_state["session_id"]
+    for it in snap["items"]:
+        fields = {
+            "status": it["status"],
+            "note": it["note"],
+            "photo": it["photo"] if photos.has(it["photo"]) else None,
+        }
+        insp.write_item(normalize_key(it["name"]), it["name"], fields, None, by, it["cat"], it["task"])
+
+    current = {
+        (inc["employee"], inc["detail"], inc["ts"].replace(microsecond=0))
+        for inc in insp.snapshot()["incidences"]
+    }
+    added = 0
+    for inc in snap["incidences"]:
+        if (inc["employee"], inc["detail"], inc["ts"]) not in current:
+            insp.add_incidence(inc["employee"], inc["detail"], inc["ts"], by)
+            current.add((inc["employee"], inc["detail"], inc["ts"]))
+            added += 1
+
+    insp.write_needs(snap["needs"], None, by)
+
+    return {
+        "community": snap["community"],
+        "date": snap["date"],
+        "master": snap["master"],
+        "items": len(snap["items"]),
+        "incidences": added,
+        "photos": copied,
+    }
+
+
+def on_restore_snapshot():
+    """
+    Callback del botón de restaurar: corre antes de dibujar, así puede mover la sesión
+    a la comunidad y fecha del respaldo.
+    """
+    uploaded = st.session_state.get("snapshot_upload")
+    if uploaded is None:
+        st.session_state["snapshot_msg"] = ("warning", "Primero selecciona un archivo de respaldo (.zip).")
+        return
+    try:
+        uploaded.seek(0)
+        summary = import_inspection_snapshot(uploaded)
+    except (zipfile.BadZipFile, ValueError, KeyError) as e:
+        st.session_state["snapshot_msg"] = ("error", f"No se pudo restaurar el respaldo: {e}")
+        return
+
+    st.session_state["community_name"] = st.session_state["community_input"] = summary["community"]
+    st.session_state["report_date"] = st.session_state["report_date_input"] = summary["date"]
+    if summary["master"]:
+        apply_master(get_master_cache().catalog_for_rows(summary["master"]))
+    else:
+        invalidate_shared_sync()
+    st.session_state["snapshot_msg"] = (
+        "success",
+        f"Respaldo restaurado: {summary['items']} ítems, {summary['incidences']} incidencias nuevas, "
+        f"{summary['photos']} fotos copiadas.",
+    )
 
 
 # ---------------------------
 # UI
 # ---------------------------
 init_state()
-ok, fail, pending, total = get_stats()
+ensure_daily_plans(date.today().isoformat())
+ensure_archived(date.today().isoformat())
+if INGEST_API_ENABLED:
+    start_ingest_api(INGEST_API_HOST, INGEST_API_PORT)
+sync_shared_inspection()
+show_shared_conflicts()
 
-# Header
-st.markdown(
-    f"""
-    <div style="padding:18px 18px 10px 18px; border-radius:16px; background: linear-gradient(90deg, #4338ca, #4f46e5); color:white;">
-      <div style="display:flex; justify-content:space-between; align-items:center; gap:16px; flex-wrap:wrap;">
-        <div>
-          <div style="font-size:24px; font-weight:800;">🛡️ Control Edificio Pro</div>
-          <div style="opacity:0.85;">Mayordomía y Gestión de Operaciones (demo Streamlit)</div>
-        </div>
-        <div style="display:flex; gap:16px;">
-          <div style="background: rgba(0,0,0,0.20); padding:10px 14px; border-radius:12px; text-align:center; min-width:120px;">
-            <div style="font-size:11px; letter-spacing:0.08em; opacity:0.8;">SISTEMAS OK</div>
-            <div style="font-size:24px; font-weight:800; color:#4ade80;">{ok}</div>
-          </div>
-          <div style="background: rgba(0,0,0,0.20); padding:10px 14px; border-radius:12px; text-align:center; min-width:120px;">
-            <div style="font-size:11px; letter-spacing:0.08em; opacity:0.8;">FALLAS</div>
-            <div style="font-size:24px; font-weight:800; color:#f87171;">{fail}</div>
+
+# Header (se refresca solo: los cambios del checklist no recargan la app completa)
+@_fragment(SHARED_POLL_SECONDS)
+def header_view():
+    ok, fail, pending, total = get_stats()
+    st.markdown(
+        f"""
+        <div style="padding:18px 18px 10px 18px; border-radius:16px; background: linear-gradient(90deg, #4338ca, #4f46e5); color:white;">
+          <div style="display:flex; justify-content:space-between; align-items:center; gap:16px; flex-wrap:wrap;">
+            <div>
+              <div style="font-size:24px; font-weight:800;">🛡️ Control Edificio Pro</div>
+              <div style="opacity:0.85;">Mayordomía y Gestión de Operaciones (demo Streamlit)</div>
+            </div>
+            <div style="display:flex; gap:16px;">
+              <div style="background: rgba(0,0,0,0.20); padding:10px 14px; border-radius:12px; text-align:center; min-width:120px;">
+                <div style="font-size:11px; letter-spacing:0.08em; opacity:0.8;">SISTEMAS OK</div>
+                <div style="font-size:24px; font-weight:800; color:#4ade80;">{ok}</div>
+              </div>
+              <div style="background: rgba(0,0,0,0.20); padding:10px 14px; border-radius:12px; text-align:center; min-width:120px;">
+                <div style="font-size:11px; letter-spacing:0.08em; opacity:0.8;">FALLAS</div>
+                <div style="font-size:24px; font-weight:800; color:#f87171;">{fail}</div>
+              </div>
+            </div>
           </div>
         </div>
-      </div>
-    </div>
-    """,
-    unsafe_allow_html=True
-)
+        """,
+        unsafe_allow_html=True
+    )
+
+
+header_view()
 st.write("")
 
 # Tabs
-tab_checklist, tab_rrhh, tab_report, tab_master = st.tabs(
-    ["✅ Levantamiento Técnico", "👥 RR.HH. (Incidencias)", "🧾 Generar Informe", "⚙️ Datos Maestros (Instalaciones)"]
+tab_checklist, tab_rrhh, tab_report, tab_search, tab_analytics, tab_master = st.tabs(
+    ["✅ Levantamiento Técnico", "👥 RR.HH. (Incidencias)", "🧾 Generar Informe", "🔎 Búsqueda", "📈 Analítica", "⚙️ Datos Maestros (Instalaciones)"]
 )
 
 # ---------------------------
@@ -578,85 +1185,104 @@ with tab_checklist:
         st.subheader("Checklist Técnico (por áreas)")
         st.caption("Marca OK / FALLA / PENDIENTE, agrega observaciones y (opcional) una foto por ítem.")
     with c2:
-        st.session_state["report_date"] = st.date_input("Fecha del informe", value=st.session_state["report_date"])
+        st.date_input("Fecha del informe", key="report_date_input", on_change=on_inspection_key_change)
 
-    st.session_state["community_name"] = st.text_input(
+    st.text_input(
         "Nombre de la comunidad",
-        value=st.session_state["community_name"],
         placeholder="Ej: Edificio Los Castaños 123",
+        key="community_input",
+        on_change=on_inspection_key_change,
     )
 
-    for cat in CATEGORIES:
-        st.markdown(f"### {cat}")
-        for it in [x for x in st.session_state["checklist_items"] if x["cat"] == cat]:
-            box = st.container(border=True)
-            with box:
-                left, mid, right = st.columns([2.2, 2.2, 1.6], gap="medium")
-
-                with left:
-                    st.markdown(f"**{it['name']}**")
-                    st.caption(it["task"])
-
-                with mid:
-                    status = st.radio(
-                        "Estado",
-                        options=["pending", "ok", "fail"],
-                        format_func=lambda v: {"pending": "Pendiente", "ok": "OK", "fail": "Falla"}[v],
-                        index=["pending", "ok", "fail"].index(it["status"]),
-                        horizontal=True,
-                        key=f"status_{it['id']}",
-                        label_visibility="collapsed",
-                    )
-                    it["status"] = status
-
-                    it["note"] = st.text_input(
-                        "Observación",
-                        value=it["note"],
-                        placeholder="Escribe una observación breve…",
-                        key=f"note_{it['id']}",
-                        label_visibility="collapsed",
-                    )
-
-                with right:
-                    st.markdown(
-                        f"""
-                        <div style="padding:10px 12px; border-radius:12px; border:1px solid #e2e8f0;">
-                          <div style="font-weight:800; color:{status_color(it['status'])}; font-size:16px;">
-                            {status_badge(it['status'])}
-                          </div>
-                          <div style="opacity:0.7; font-size:12px;">Ítem #{it['id']}</div>
-                        </div>
-                        """,
-                        unsafe_allow_html=True,
-                    )
-
-                    uploaded = st.file_uploader(
-                        "Foto (opcional)",
-                        type=["png", "jpg", "jpeg"],
-                        key=f"photo_{it['id']}",
-                        label_visibility="collapsed",
-                    )
-                    if uploaded is not None:
-                        it["photo"] = uploaded.getvalue()
-                        st.image(it["photo"], caption="Foto adjunta", use_container_width=True)
-
-        st.divider()
-
-    colA, colB, colC = st.columns([1, 1, 2])
-    with colA:
-        if st.button("🔄 Marcar todo como Pendiente"):
-            for it in st.session_state["checklist_items"]:
-                it["status"] = "pending"
-            st.rerun()
+    checklist = st.session_state["checklist_items"]
+    st.caption(
+        f"Para esta fecha corresponden {len(checklist)} de {len(checklist.catalog.items)} instalaciones según su frecuencia "
+        f"(semanales los {WEEKDAY_NAMES[PLAN_WEEKLY_WEEKDAY]}, mensuales el día {PLAN_MONTHLY_DAY})."
+    )
 
-    with colB:
-        if st.button("✅ Marcar todo como OK"):
-            for it in st.session_state["checklist_items"]:
-                it["status"] = "ok"
-            st.rerun()
+    @_fragment(SHARED_POLL_SECONDS)
+    def checklist_items_view():
+        """
+        Ítems del checklist: se vuelven a dibujar solos cada SHARED_POLL_SECONDS con los cambios
+        de otras sesiones, y al editar un ítem sólo se rerenderiza este bloque.
+        """
+        sync_shared_inspection(in_fragment=True)
+        show_shared_conflicts()
+
+        for cat in CATEGORIES:
+            st.markdown(f"### {cat}")
+            for it in [x for x in st.session_state["checklist_items"] if x["cat"] == cat]:
+                box = st.container(border=True)
+                with box:
+                    left, mid, right = st.columns([2.2, 2.2, 1.6], gap="medium")
+
+                    with left:
+                        st.markdown(f"**{it['name']}**")
+                        st.caption(f"{it['task']} · {it['freq']}")
+
+                    with mid:
+                        # estado inicial del widget desde el ítem (luego lo mantienen los callbacks y la sincronización)
+                        st.session_state.setdefault(f"status_{it['id']}", it["status"])
+                        st.session_state.setdefault(f"note_{it['id']}", it["note"])
+
+                        status = st.radio(
+                            "Estado",
+                            options=["pending", "ok", "fail"],
+                            format_func=lambda v: {"pending": "Pendiente", "ok": "OK", "fail": "Falla"}[v],
+                            horizontal=True,
+                            key=f"status_{it['id']}",
+                            label_visibility="collapsed",
+                            on_change=on_item_widget_change,
+                            args=(it["id"], "status"),
+                        )
+                        it["status"] = status
+
+                        it["note"] = st.text_input(
+                            "Observación",
+                            placeholder="Escribe una observación breve…",
+                            key=f"note_{it['id']}",
+                            label_visibility="collapsed",
+                            on_change=on_item_widget_change,
+                            args=(it["id"], "note"),
+                        )
+
+                    with right:
+                        st.markdown(
+                            f"""
+                            <div style="padding:10px 12px; border-radius:12px; border:1px solid #e2e8f0;">
+                              <div style="font-weight:800; color:{status_color(it['status'])}; font-size:16px;">
+                                {status_badge(it['status'])}
+                              </div>
+                              <div style="opacity:0.7; font-size:12px;">Ítem #{it['id']}</div>
+                            </div>
+                            """,
+                            unsafe_allow_html=True,
+                        )
+
+                        st.file_uploader(
+                            "Foto (opcional)",
+                            type=["png", "jpg", "jpeg"],
+                            key=f"photo_{it['id']}",
+                            label_visibility="collapsed",
+                            on_change=on_item_widget_change,
+                            args=(it["id"], "photo"),
+                        )
+                        if it.get("photo"):
+                            st.image(photo_preview(it["photo"]), caption="Foto adjunta", use_container_width=True)
+
+            st.divider()
+
+        colA, colB, colC = st.columns([1, 1, 2])
+        with colA:
+            st.button("🔄 Marcar todo como Pendiente", on_click=on_mark_all, args=("pending",))
+
+        with colB:
+            st.button("✅ Marcar todo como OK", on_click=on_mark_all, args=("ok",))
 
-    with colC:
-        st.info("Tip: sin base de datos, el contenido se mantiene mientras no cierres/recargues la pestaña. Para persistencia real, se integra Firebase/Sheets.")
+        with colC:
+            st.info("Tip: los cambios se comparten con las demás sesiones abiertas de la misma comunidad y fecha (se actualizan solas cada pocos segundos).")
+
+    checklist_items_view()
 
 
 # ---------------------------
@@ -675,11 +1301,7 @@ with tab_rrhh:
             if not employee.strip() or not detail.strip():
                 st.error("Por favor completa nombre del empleado y detalle.")
             else:
-                incidences = st.session_state["incidences"]
-                new_id = (max([i["id"] for i in incidences]) + 1) if incidences else 1
-                st.session_state["incidences"].append(
-                    {"id": new_id, "employee": employee.strip(), "detail": detail.strip(), "ts": datetime.now()}
-                )
+                add_incidence(employee.strip(), detail.strip())
                 st.success("Incidencia registrada.")
 
     st.write("")
@@ -698,7 +1320,7 @@ with tab_rrhh:
                     st.write(inc["detail"])
                 with c3:
                     if st.button("🗑️", key=f"del_inc_{inc['id']}", help="Eliminar incidencia"):
-                        st.session_state["incidences"] = [x for x in st.session_state["incidences"] if x["id"] != inc["id"]]
+                        delete_incidence(inc["id"])
                         st.rerun()
 
 
@@ -709,9 +1331,10 @@ with tab_report:
     st.subheader("Generador de Informe (descarga PDF o Word con fotos)")
     st.caption("El PDF se exporta con estructura visual (3 columnas por área). El Word se exporta en texto + anexo de fotos (por ahora).")
 
-    st.session_state["needs"] = st.text_area(
+    st.text_area(
         "Requerimientos y compras (texto libre)",
-        value=st.session_state["needs"],
+        key="needs_input",
+        on_change=on_needs_change,
         height=140,
         placeholder="Ej: Solicitar mantención ascensores / compra de luminarias / repuestos bomba…",
     )
@@ -727,25 +1350,132 @@ with tab_report:
 
     col1, col2 = st.columns([1, 2])
     with col1:
-        if fmt.startswith("PDF"):
-            pdf_bytes = generate_pdf_bytes_visual()
-            st.download_button(
-                "⬇️ Descargar PDF (Visual, con fotos)",
-                data=pdf_bytes,
-                file_name=f"{file_base}.pdf",
-                mime="application/pdf",
-            )
-        else:
-            docx_bytes = generate_docx_bytes(report_text)
+        # se genera y se entrega sólo en el rerun en que se pide: los demás reruns (y los cambios
+        # de otras sesiones) no lo reconstruyen ni lo mantienen en memoria
+        if st.button("Generar informe", type="primary"):
+            with st.spinner("Generando informe…"):
+                if fmt.startswith("PDF"):
+                    spool = generate_pdf_visual()
+                    meta = {"label": "⬇️ Descargar PDF (Visual, con fotos)", "file_name": f"{file_base}.pdf",
+                            "mime": "application/pdf"}
+                else:
+                    spool = generate_docx(report_text)
+                    meta = {"label": "⬇️ Descargar Word (DOCX) (con fotos)", "file_name": f"{file_base}.docx",
+                            "mime": "application/vnd.openxmlformats-officedocument.wordprocessingml.document"}
+            st.download_button(data=spool_download_data(spool), **meta)
+            st.caption(f"Generado a las {datetime.now().strftime('%H:%M')}. Descárgalo ahora: al seguir usando la app el botón se retira.")
+
+    with col2:
+        st.info(f"Las fotos se incluyen reducidas (lado mayor {REPORT_PHOTO_MAX_PX} px) para que el informe no crezca con la resolución de la cámara.")
+
+    st.divider()
+    st.markdown("#### 💾 Respaldo de la inspección")
+    st.caption("Guarda toda la inspección (estados, observaciones, fotos, incidencias y requerimientos) en un solo archivo .zip para retomarla o moverla a otro equipo.")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("Preparar respaldo"):
+            spool = export_inspection_snapshot(current_inspection(), st.session_state["checklist_items"].catalog)
             st.download_button(
-                "⬇️ Descargar Word (DOCX) (con fotos)",
-                data=docx_bytes,
-                file_name=f"{file_base}.docx",
-                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                "⬇️ Descargar respaldo (.zip)",
+                data=spool_download_data(spool),
+                file_name=f"respaldo_{file_base.removeprefix('informe_')}.zip",
+                mime="application/zip",
             )
-
     with col2:
-        st.info("Tip: si subes muchas fotos grandes, el PDF/DOCX puede quedar pesado. Si quieres, agregamos compresión automática.")
+        st.file_uploader("Respaldo a restaurar (.zip)", type=["zip"], key="snapshot_upload")
+        st.button("♻️ Restaurar respaldo", on_click=on_restore_snapshot)
+
+    if st.session_state.get("snapshot_msg"):
+        kind, msg = st.session_state.pop("snapshot_msg")
+        getattr(st, kind)(msg)
+
+
+# ---------------------------
+# Search (historial)
+# ---------------------------
+with tab_search:
+    st.subheader("Búsqueda en el historial")
+    st.caption("Busca en observaciones, instalaciones, tareas e incidencias de todas las fechas (no distingue acentos ni mayúsculas).")
+
+    c1, c2, c3 = st.columns([3, 1.2, 1.2])
+    with c1:
+        q = st.text_input("Buscar", placeholder="Ej: filtración subterraneo / Juan Pérez", key="search_q")
+    with c2:
+        kind_label = st.selectbox("Tipo", options=["Todo", "Checklist", "Incidencias"], key="search_kind")
+    with c3:
+        only_current = st.checkbox("Sólo esta comunidad", value=False, key="search_only_current")
+
+    if q.strip():
+        page = st.number_input("Página", min_value=1, value=1, step=1, key="search_page")
+        t0 = time.perf_counter()
+        total, results = get_history_store().search(
+            q,
+            community=st.session_state["community_name"] if only_current else "",
+            kind={"Todo": "", "Checklist": "item", "Incidencias": "incidence"}[kind_label],
+            page=int(page),
+            page_size=SEARCH_PAGE_SIZE,
+        )
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        pages = max(1, -(-total // SEARCH_PAGE_SIZE))
+        st.caption(f"{total} resultados • página {int(page)} de {pages} • {elapsed_ms:.0f} ms")
+
+        for r in results:
+            with st.container(border=True):
+                where = f"{r['community']} · {r['day']}" + (" · 🗄️ archivado" if r["archived"] else "")
+                if r["kind"] == "item":
+                    st.markdown(f"**{r['name']}** ({r['task'] or '—'}) · {where}")
+                else:
+                    st.markdown(f"**Incidencia – {r['employee']}** · {where}")
+                st.markdown(r["snippet"])
+
+
+# ---------------------------
+# Analytics (historial)
+# ---------------------------
+with tab_analytics:
+    st.subheader("Analítica de fallas")
+    st.caption("Tasas de falla, MTBF y rachas de FALLA sobre el historial de inspecciones (desde el inicio del mes; se actualiza cada minuto).")
+
+    c1, c2 = st.columns([1.5, 1.5])
+    with c1:
+        period = st.selectbox(
+            "Periodo",
+            options=[30, 90, 365, 730],
+            index=1,
+            format_func=lambda d: {30: "Últimos 30 días", 90: "Últimos 90 días", 365: "Último año", 730: "Últimos 2 años"}[d],
+            key="analytics_period",
+        )
+    with c2:
+        scope = st.radio("Alcance", options=["Todas las comunidades", "Sólo esta comunidad"], horizontal=True, key="analytics_scope")
+
+    since = date.fromordinal(date.today().toordinal() - int(period))
+    data = load_failure_analytics(
+        since, st.session_state["community_name"] if scope.startswith("Sólo") else ""
+    )
+
+    if data is None:
+        st.info("Aún no hay historial para este periodo.")
+    else:
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("Revisiones (OK + Falla)", data["checks"])
+        m2.metric("Fallas", data["fails"])
+        m3.metric("Episodios de falla", data["episodes"])
+        m4.metric("Tasa de falla", f"{(data['fails'] / data['checks'] * 100) if data['checks'] else 0:.1f} %")
+
+        st.markdown("#### Tendencia diaria (% de fallas)")
+        st.line_chart(data["trend"], x="Día", y="Tasa falla %")
+
+        left, right = st.columns(2)
+        with left:
+            st.markdown("#### Por tipo")
+            st.dataframe(data["categories"], hide_index=True, use_container_width=True)
+        with right:
+            st.markdown("#### Ranking de edificios")
+            st.dataframe(data["buildings"], hide_index=True, use_container_width=True)
+
+        st.markdown(f"#### Instalaciones con más fallas (top {ANALYTICS_TOP_N})")
+        st.dataframe(data["installations"], hide_index=True, use_container_width=True)
 
 
 # ---------------------------
@@ -769,12 +1499,15 @@ with tab_master:
     uploaded_xlsx = st.file_uploader(
         "Cargar plantilla XLSX (reemplaza las instalaciones actuales)",
         type=["xlsx"],
-        help="Debe contener columnas: Tipo, Instalación (Tarea opcional).",
+        help="Debe contener columnas: Tipo, Instalación (Tarea y Frecuencia opcionales).",
     )
 
-    if uploaded_xlsx is not None:
+    # el archivo sigue en el uploader tras el rerun: se importa sólo si cambió
+    xlsx_digest = hashlib.sha256(uploaded_xlsx.getvalue()).hexdigest() if uploaded_xlsx is not None else None
+    if xlsx_digest is not None and xlsx_digest != st.session_state.get("master_xlsx_digest"):
         try:
             import_master_from_xlsx(uploaded_xlsx.getvalue())
+            st.session_state["master_xlsx_digest"] = xlsx_digest
             st.success("Datos maestros cargados. Se actualizó el checklist.")
             st.rerun()
         except Exception as e:
@@ -785,30 +1518,25 @@ with tab_master:
     # Agregar instalación manual
     st.markdown("### ➕ Agregar instalación (manual)")
     with st.form("add_installation"):
-        colA, colB, colC = st.columns([1.3, 2.2, 2.2])
+        colA, colB, colC, colD = st.columns([1.3, 2.2, 2.2, 1.1])
         with colA:
             tipo = st.selectbox("Tipo", options=CATEGORIES)
         with colB:
             instalacion = st.text_input("Instalación", placeholder="Ej: Sala de Tableros")
         with colC:
             tarea = st.text_input("Tarea (opcional)", placeholder="Ej: Revisión térmica / limpieza / fugas")
+        with colD:
+            frecuencia = st.selectbox("Frecuencia", options=FREQUENCIES)
 
         add = st.form_submit_button("Agregar")
         if add:
             if not instalacion.strip():
                 st.error("Debes indicar el nombre de la instalación.")
             else:
-                items = st.session_state["checklist_items"]
-                new_id = max([x["id"] for x in items], default=0) + 1
-                items.append({
-                    "id": new_id,
-                    "cat": tipo,
-                    "name": instalacion.strip(),
-                    "task": tarea.strip() or "—",
-                    "status": "pending",
-                    "note": "",
-                    "photo": None,
-                })
+                # nueva versión de los datos maestros (el catálogo compartido no se modifica)
+                rows = st.session_state["checklist_items"].catalog.rows()
+                rows.append({"Tipo": tipo, "Instalación": instalacion.strip(), "Tarea": tarea.strip(), "Frecuencia": frecuencia})
+                apply_master(get_master_cache().catalog_for_rows(rows))
                 st.success("Instalación agregada.")
                 st.rerun()
 
@@ -816,8 +1544,9 @@ with tab_master:
 
     # Eliminar instalaciones
     st.markdown("### 🗑️ Quitar instalaciones")
-    items = st.session_state["checklist_items"]
-    options = [f"#{x['id']} | {x['cat']} | {x['name']}" for x in items]
+    # todas las instalaciones de los datos maestros (no sólo las que corresponden hoy)
+    catalog = st.session_state["checklist_items"].catalog
+    options = [f"#{x['id']} | {x['cat']} | {x['name']} ({x['freq']})" for x in catalog.items]
     to_remove = st.multiselect("Selecciona instalaciones a eliminar", options=options)
 
     if st.button("Eliminar seleccionadas"):
@@ -834,15 +1563,9 @@ with tab_master:
                 except:
                     pass
 
-            st.session_state["checklist_items"] = [x for x in st.session_state["checklist_items"] if x["id"] not in ids]
-            # Reasignar IDs (limpio y ordenado)
-            rebuilt = []
-            nid = 1
-            for x in st.session_state["checklist_items"]:
-                x["id"] = nid
-                rebuilt.append(x)
-                nid += 1
-            st.session_state["checklist_items"] = rebuilt
+            # nueva versión sin las seleccionadas (los IDs se reasignan limpios y ordenados)
+            rows = [r for x, r in zip(catalog.items, catalog.rows()) if x["id"] not in ids]
+            apply_master(get_master_cache().catalog_for_rows(rows))
 
             st.success("Instalaciones eliminadas.")
             st.rerun()
@@ -852,7 +1575,7 @@ with tab_master:
     # Reset defaults
     st.markdown("### 🔁 Restaurar instalaciones por defecto")
     if st.button("Restaurar checklist por defecto (precargado)"):
-        st.session_state["checklist_items"] = build_checklist_items_from_master(DEFAULT_INSTALLATIONS)
+        apply_master(get_master_cache().catalog_for_rows(DEFAULT_INSTALLATIONS))
         st.success("Restaurado.")
         st.rerun()
 
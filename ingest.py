@@ -0,0 +1,199 @@
+"""
+API local de ingesta (BMS / CMMS): validación de lotes y handler HTTP de POST /api/inspecciones.
+Sin dependencias de Streamlit: los lotes se aplican sobre un SharedStore (ver shared.py).
+"""
+import base64
+import binascii
+import json
+from datetime import datetime, date
+from http.server import BaseHTTPRequestHandler
+from io import BytesIO
+
+from shared import SharedStore
+from storage import normalize_key
+
+INGEST_MAX_BODY_BYTES = 64 * 1024 * 1024
+INGEST_MAX_BATCH_ITEMS = 2000
+
+
+STATUS_ALIASES = {
+    "ok": "ok",
+    "fail": "fail",
+    "falla": "fail",
+    "pending": "pending",
+    "pendiente": "pending",
+    "pend.": "pending",
+}
+
+
+def parse_ingest_batch(batch: dict) -> dict:
+    """
+    Valida un lote recibido por la API y lo deja en forma normalizada:
+    {community, date, items: {nombre_normalizado: {...}}, incidences: [...]}
+    Lanza ValueError con el detalle si algo no es válido (el lote se rechaza completo).
+    """
+    if not isinstance(batch, dict):
+        raise ValueError("Cada lote debe ser un objeto JSON.")
+
+    community = str(batch.get("community") or batch.get("comunidad") or "").strip()
+    if not community:
+        raise ValueError("Falta 'community'.")
+
+    day = date.today()
+    if batch.get("date"):
+        try:
+            day = date.fromisoformat(str(batch["date"]))
+        except ValueError:
+            raise ValueError("'date' debe ser fecha ISO (AAAA-MM-DD).")
+
+    raw_items = batch.get("items") or []
+    raw_incs = batch.get("incidences") or batch.get("incidencias") or []
+    if not isinstance(raw_items, list) or not isinstance(raw_incs, list):
+        raise ValueError("'items' e 'incidences' deben ser listas.")
+    if len(raw_items) > INGEST_MAX_BATCH_ITEMS:
+        raise ValueError(f"Máximo {INGEST_MAX_BATCH_ITEMS} ítems por lote.")
+
+    items = {}
+    for n, r in enumerate(raw_items, start=1):
+        if not isinstance(r, dict):
+            raise ValueError(f"items[{n}]: debe ser un objeto.")
+        name = str(r.get("Instalación") or r.get("instalacion") or "").strip()
+        if not name:
+            raise ValueError(f"items[{n}]: falta 'Instalación'.")
+
+        upd = {"name": name}
+        if r.get("status") is not None:
+            status = STATUS_ALIASES.get(str(r["status"]).strip().lower())
+            if status is None:
+                raise ValueError(f"items[{n}]: estado inválido '{r['status']}' (ok / fail / pending).")
+            upd["status"] = status
+        if r.get("note") is not None:
+            upd["note"] = str(r["note"]).strip()
+        if r.get("photo"):
+            try:
+                upd["photo"] = base64.b64decode(r["photo"], validate=True)
+            except (binascii.Error, TypeError, ValueError):
+                raise ValueError(f"items[{n}]: 'photo' debe venir en base64.")
+            # misma regla que el uploader del checklist: sólo JPEG / PNG legibles
+            from PIL import Image
+
+            try:
+                with Image.open(BytesIO(upd["photo"])) as img:
+                    fmt = img.format
+                    img.verify()
+            except Exception:
+                raise ValueError(f"items[{n}]: 'photo' no es una imagen válida.")
+            if fmt not in ("JPEG", "PNG"):
+                raise ValueError(f"items[{n}]: 'photo' debe ser JPEG o PNG.")
+
+        # Dentro de un lote, la última actualización de cada instalación gana
+        key = normalize_key(name)
+        items[key] = {**items.get(key, {}), **upd}
+
+    incidences = []
+    for n, r in enumerate(raw_incs, start=1):
+        if not isinstance(r, dict):
+            raise ValueError(f"incidences[{n}]: debe ser un objeto.")
+        employee = str(r.get("employee") or "").strip()
+        detail = str(r.get("detail") or "").strip()
+        if not employee or not detail:
+            raise ValueError(f"incidences[{n}]: faltan 'employee' y/o 'detail'.")
+        ts = datetime.now()
+        if r.get("ts"):
+            try:
+                ts = datetime.fromisoformat(str(r["ts"]))
+            except ValueError:
+                raise ValueError(f"incidences[{n}]: 'ts' debe ser fecha ISO 8601.")
+        incidences.append({"employee": employee, "detail": detail, "ts": ts})
+
+    return {
+        "community": community,
+        "date": day,
+        "items": items,
+        "incidences": incidences,
+    }
+
+
+def make_ingest_handler(store: SharedStore):
+    class IngestHandler(BaseHTTPRequestHandler):
+        server_version = "ControlEdificioAPI/1.0"
+
+        def _send_json(self, code: int, payload: dict):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Silencioso: no ensuciar la consola de Streamlit
+            pass
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/api/salud":
+                self._send_json(200, {"ok": True})
+            else:
+                self._send_json(404, {"error": "Ruta no encontrada."})
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/api/inspecciones":
+                self._send_json(404, {"error": "Ruta no encontrada."})
+                return
+
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+            except ValueError:
+                self._send_json(400, {"error": "Content-Length inválido."})
+                return
+            if length <= 0 or length > INGEST_MAX_BODY_BYTES:
+                self._send_json(413 if length else 400, {"error": "Cuerpo vacío o demasiado grande."})
+                return
+
+            try:
+                payload = json.loads(self.rfile.read(length).decode("utf-8"))
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                self._send_json(400, {"error": "JSON inválido."})
+                return
+
+            # Un request puede traer un lote o varios ({"batches": [...]})
+            if isinstance(payload, dict) and "batches" in payload:
+                raw_batches = payload["batches"]
+            else:
+                raw_batches = [payload]
+            if not isinstance(raw_batches, list) or not raw_batches:
+                self._send_json(400, {"error": "'batches' debe ser una lista no vacía."})
+                return
+
+            header_key = (self.headers.get("Idempotency-Key") or "").strip()
+            batches, keys = [], []
+            try:
+                for n, raw in enumerate(raw_batches):
+                    batches.append(parse_ingest_batch(raw))
+                    key = str(raw.get("idempotency_key") or "").strip()
+                    if not key and header_key:
+                        key = header_key if len(raw_batches) == 1 else f"{header_key}#{n}"
+                    keys.append(key)
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+                return
+
+            for n, batch in enumerate(batches, start=1):
+                unknown = store.unknown_items(batch)
+                if unknown:
+                    self._send_json(400, {
+                        "error": f"Lote {n}: instalaciones que no están en los datos maestros de '{batch['community']}'.",
+                        "unknown": unknown,
+                    })
+                    return
+                not_due = store.not_due_items(batch)
+                if not_due:
+                    self._send_json(400, {
+                        "error": f"Lote {n}: instalaciones que según su frecuencia no tocan el {batch['date'].isoformat()}.",
+                        "not_due": not_due,
+                    })
+                    return
+
+            self._send_json(202, {"accepted": store.ingest(batches, keys)})
+
+    return IngestHandler
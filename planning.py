@@ -0,0 +1,350 @@
+"""
+Datos maestros y planificación: catálogos compartidos entre sesiones (solo lectura), checklist
+por sesión (copy-on-write) y los ítems que tocan cada día según su frecuencia.
+Sin dependencias de Streamlit: los datos maestros por edificio y los planes viven en HistoryStore.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import date
+from types import MappingProxyType
+
+from storage import HistoryStore, normalize_key
+
+# ---------------------------
+# Master data (defaults)
+# ---------------------------
+CATEGORIES = ["Críticos", "Accesos", "Higiene", "Comunes", "Infra"]
+FREQUENCIES = ["Diaria", "Semanal", "Mensual"]
+
+DEFAULT_INSTALLATIONS = [
+    {"Tipo": "Críticos", "Instalación": "Sala de Bombas", "Tarea": "Presión y alternancia", "Frecuencia": "Diaria"},
+    {"Tipo": "Críticos", "Instalación": "Sala de Calderas", "Tarea": "Temperatura y fugas", "Frecuencia": "Diaria"},
+    {"Tipo": "Críticos", "Instalación": "Generador", "Tarea": "Nivel petróleo y batería", "Frecuencia": "Semanal"},
+    {"Tipo": "Críticos", "Instalación": "PEAS (Presurización)", "Tarea": "Prueba de ventilador", "Frecuencia": "Mensual"},
+    {"Tipo": "Críticos", "Instalación": "Ascensores (2)", "Tarea": "Nivelación y limpieza rieles", "Frecuencia": "Semanal"},
+    {"Tipo": "Accesos", "Instalación": "Portones (2)", "Tarea": "Sensores y velocidad", "Frecuencia": "Diaria"},
+    {"Tipo": "Accesos", "Instalación": "Control Biométrico", "Tarea": "Lectores huella/tarjeta", "Frecuencia": "Semanal"},
+    {"Tipo": "Higiene", "Instalación": "Sala de Basura", "Tarea": "Desinfección y contenedores", "Frecuencia": "Diaria"},
+    {"Tipo": "Higiene", "Instalación": "Ductos (20 pisos)", "Tarea": "Cierre de escotillas", "Frecuencia": "Semanal"},
+    {"Tipo": "Comunes", "Instalación": "Piscina", "Tarea": "Parámetros Cl/pH", "Frecuencia": "Diaria"},
+    {"Tipo": "Comunes", "Instalación": "Quincho / Eventos", "Tarea": "Mobiliario e higiene", "Frecuencia": "Semanal"},
+    {"Tipo": "Comunes", "Instalación": "Gym / Sauna", "Tarea": "Máquinas y tableros", "Frecuencia": "Semanal"},
+    {"Tipo": "Infra", "Instalación": "Pasillos (1-20)", "Tarea": "Luces de emergencia", "Frecuencia": "Semanal"},
+    {"Tipo": "Infra", "Instalación": "Subterráneo", "Tarea": "Filtraciones y limpieza", "Frecuencia": "Diaria"},
+    {"Tipo": "Infra", "Instalación": "Jardines", "Tarea": "Riego programado", "Frecuencia": "Diaria"},
+]
+
+# Planificación: días que se materializan por adelantado y día de las revisiones semanales / mensuales
+PLAN_HORIZON_DAYS = 14
+PLAN_WEEKLY_WEEKDAY = 0            # lunes
+PLAN_MONTHLY_DAY = 1
+
+# Versiones de datos maestros que se mantienen parseadas en memoria (compartidas entre sesiones)
+MASTER_CACHE_MAX = 64
+
+
+# ---------------------------
+# Filas maestras
+# ---------------------------
+def parse_master_rows(master_rows) -> list:
+    """
+    master_rows: list of dicts with keys Tipo, Instalación, Tarea (optional), Frecuencia (optional)
+    Returns normalized master item dicts (id, cat, name, task, freq)
+    """
+    items = []
+    next_id = 1
+    for r in master_rows:
+        cat = (r.get("Tipo") or "").strip()
+        name = (r.get("Instalación") or "").strip()
+        task = (r.get("Tarea") or "").strip() or "—"
+        freq = map_frecuencia(r.get("Frecuencia"))
+
+        if not cat or not name:
+            continue
+
+        # Normaliza cat a las categorías permitidas si viene con variantes
+        if cat not in CATEGORIES:
+            # Si viene "Espacio Común" etc., intenta mapear a Comunes
+            mapped = map_tipo_to_category(cat)
+            cat = mapped
+
+        items.append({
+            "id": next_id,
+            "cat": cat,
+            "name": name,
+            "task": task,
+            "freq": freq,
+        })
+        next_id += 1
+
+    return items
+
+
+def map_tipo_to_category(tipo: str) -> str:
+    """
+    Mapea 'Tipo' libre a una categoría soportada.
+    """
+    t = (tipo or "").strip().lower()
+    if "crit" in t:
+        return "Críticos"
+    if "infra" in t:
+        return "Infra"
+    if "comun" in t or "común" in t or "espacio" in t:
+        return "Comunes"
+    if "hig" in t or "aseo" in t or "basura" in t:
+        return "Higiene"
+    if "acces" in t or "port" in t:
+        return "Accesos"
+    # fallback
+    return "Comunes"
+
+
+def map_frecuencia(freq) -> str:
+    """
+    Mapea 'Frecuencia' libre a una frecuencia soportada (vacío = Diaria).
+    """
+    f = (str(freq or "")).strip().lower()
+    if f.startswith("sem") or "week" in f:
+        return "Semanal"
+    if f.startswith("mens") or "month" in f:
+        return "Mensual"
+    return "Diaria"
+
+
+# ---------------------------
+# Datos maestros compartidos (solo lectura) + estado por sesión
+# ---------------------------
+ITEM_STATE_DEFAULTS = {"status": "pending", "note": "", "photo": None, "version": 0}
+
+
+class MasterCatalog:
+    """
+    Datos maestros ya parseados (id, cat, name, task), inmutables y compartidos por todas
+    las sesiones que usan la misma versión. key = hash del contenido (la "versión").
+    """
+
+    __slots__ = ("key", "items")
+
+    def __init__(self, key: str, items: list):
+        self.key = key
+        self.items = tuple(MappingProxyType(x) for x in items)
+
+    def rows(self) -> list:
+        """
+        Vuelve al formato de filas maestras (Tipo, Instalación, Tarea) para derivar una nueva versión.
+        """
+        return [
+            {"Tipo": x["cat"], "Instalación": x["name"], "Tarea": x["task"], "Frecuencia": x["freq"]}
+            for x in self.items
+        ]
+
+
+class ChecklistItem:
+    """
+    Vista de un ítem del checklist: los campos maestros se leen del catálogo compartido y los
+    campos mutables (status, note, photo, version) del overlay de la sesión, que sólo se crea
+    al escribir algo distinto del valor por defecto (copy-on-write).
+    """
+
+    __slots__ = ("_master", "_overlays")
+
+    def __init__(self, master, overlays: dict):
+        self._master = master
+        self._overlays = overlays
+
+    def __getitem__(self, key):
+        if key in ITEM_STATE_DEFAULTS:
+            ov = self._overlays.get(self._master["id"])
+            return ov.get(key, ITEM_STATE_DEFAULTS[key]) if ov else ITEM_STATE_DEFAULTS[key]
+        return self._master[key]
+
+    def __setitem__(self, key, value):
+        if key not in ITEM_STATE_DEFAULTS:
+            raise KeyError(f"'{key}' es dato maestro (solo lectura).")
+        ov = self._overlays.get(self._master["id"])
+        if ov is None:
+            if value == ITEM_STATE_DEFAULTS[key]:
+                return
+            ov = self._overlays[self._master["id"]] = {}
+        ov[key] = value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class Checklist:
+    """
+    Checklist de la sesión: catálogo compartido + overlays propios {id: {campo: valor}}.
+    Se itera como la lista de ítems. due_ids limita el checklist a los ítems que corresponden
+    ese día según su frecuencia (None = todos).
+    """
+
+    __slots__ = ("catalog", "overlays", "_views")
+
+    def __init__(self, catalog: MasterCatalog, due_ids=None):
+        self.catalog = catalog
+        self.overlays = {}
+        due = set(due_ids) if due_ids is not None else None
+        self._views = tuple(
+            ChecklistItem(m, self.overlays) for m in catalog.items if due is None or m["id"] in due
+        )
+
+    def __iter__(self):
+        return iter(self._views)
+
+    def __len__(self):
+        return len(self._views)
+
+
+class MasterCache:
+    """
+    Caché de catálogos maestros por proceso: cada versión (por contenido) se parsea una vez.
+    Las filas tal como llegan y las plantillas XLSX se indexan además por su hash,
+    para no volver a parsearlas (p. ej. DEFAULT_INSTALLATIONS en cada sesión nueva).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._catalogs = OrderedDict()  # key -> MasterCatalog
+        self._raw = OrderedDict()       # sha256(filas sin parsear) -> key
+        self._xlsx = OrderedDict()      # sha256(archivo) -> key
+
+    def _remember(self, store: OrderedDict, key, value):
+        store[key] = value
+        store.move_to_end(key)
+        while len(store) > MASTER_CACHE_MAX:
+            store.popitem(last=False)
+
+    def catalog_for_rows(self, master_rows) -> MasterCatalog:
+        raw = json.dumps(master_rows, ensure_ascii=False, sort_keys=True, default=str)
+        raw_digest = hashlib.sha256(raw.encode("utf-8")).hexdigest()
+        with self._lock:
+            key = self._raw.get(raw_digest)
+            cat = self._catalogs.get(key) if key else None
+            if cat is not None:
+                self._remember(self._catalogs, key, cat)
+                return cat
+
+        items = parse_master_rows(master_rows)
+        payload = json.dumps([[x["cat"], x["name"], x["task"], x["freq"]] for x in items], ensure_ascii=False)
+        key = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+        with self._lock:
+            cat = self._catalogs.get(key)
+            if cat is None:
+                cat = MasterCatalog(key, items)
+            self._remember(self._catalogs, key, cat)
+            self._remember(self._raw, raw_digest, key)
+            return cat
+
+    def get(self, key: str):
+        with self._lock:
+            return self._catalogs.get(key)
+
+    def catalog_for_xlsx(self, file_bytes: bytes, parse) -> MasterCatalog:
+        """
+        parse(file_bytes) -> filas maestras (la lectura del XLSX vive en app.py, con openpyxl).
+        """
+        digest = hashlib.sha256(file_bytes).hexdigest()
+        with self._lock:
+            key = self._xlsx.get(digest)
+            cat = self._catalogs.get(key) if key else None
+        if cat is not None:
+            return cat
+
+        cat = self.catalog_for_rows(parse(file_bytes))
+        with self._lock:
+            self._remember(self._xlsx, digest, cat.key)
+        return cat
+
+
+# ---------------------------
+# Planificación (frecuencia por instalación)
+# ---------------------------
+def is_due(freq: str, day: date) -> bool:
+    """
+    Diaria: todos los días. Semanal: el día PLAN_WEEKLY_WEEKDAY. Mensual: el día PLAN_MONTHLY_DAY.
+    """
+    if freq == "Semanal":
+        return day.weekday() == PLAN_WEEKLY_WEEKDAY
+    if freq == "Mensual":
+        return day.day == PLAN_MONTHLY_DAY
+    return True
+
+
+def due_item_ids(catalog: MasterCatalog, day: date) -> list:
+    return [x["id"] for x in catalog.items if is_due(x["freq"], day)]
+
+
+def _plan_rows(community_key: str, catalog: MasterCatalog, start: date, days: int) -> list:
+    rows = []
+    for n in range(days):
+        d = date.fromordinal(start.toordinal() + n)
+        rows.append((d.isoformat(), community_key, catalog.key, json.dumps(due_item_ids(catalog, d))))
+    return rows
+
+
+class Planner:
+    """
+    Datos maestros por edificio y checklists planificados (tablas building_masters y plan_due).
+    Sólo save_master guarda datos maestros: un edificio sin datos propios usa los de por defecto
+    sin dejar nada guardado, así un nombre a medio escribir o mal tipeado no queda planificado.
+    """
+
+    def __init__(self, history: HistoryStore, cache: MasterCache):
+        self.history = history
+        self.cache = cache
+
+    def default_catalog(self) -> MasterCatalog:
+        return self.cache.catalog_for_rows(DEFAULT_INSTALLATIONS)
+
+    def catalog_for_building(self, catalog_key: str, rows: list) -> MasterCatalog:
+        return self.cache.get(catalog_key) or self.cache.catalog_for_rows(rows)
+
+    def building_catalog(self, community: str) -> MasterCatalog:
+        """
+        Datos maestros vigentes del edificio (o los de por defecto si aún no tiene propios).
+        """
+        saved = self.history.building_master(community)
+        return self.catalog_for_building(*saved) if saved else self.default_catalog()
+
+    def plan_days(self, start: date, days: int = PLAN_HORIZON_DAYS) -> int:
+        """
+        Materializa en un solo lote los checklists de los próximos días para todos los edificios.
+        """
+        rows = []
+        for ckey, catalog_key, master_rows in self.history.building_masters():
+            rows += _plan_rows(ckey, self.catalog_for_building(catalog_key, master_rows), start, days)
+        self.history.save_plans(rows)
+        return len(rows)
+
+    def save_master(self, community: str, catalog: MasterCatalog, today: date):
+        """
+        Fija los datos maestros del edificio y vuelve a planificar sus próximos días.
+        """
+        community = " ".join(community.split())
+        self.history.save_building_master(community, catalog.key, catalog.rows())
+        self.history.save_plans(_plan_rows(normalize_key(community), catalog, today, PLAN_HORIZON_DAYS))
+
+    def day_checklist(self, community: str, day: date) -> Checklist:
+        """
+        Checklist del edificio para un día: sólo los ítems planificados (índice plan_due).
+        Sin datos maestros propios se calcula con los de por defecto, sin guardar plan.
+        """
+        saved = self.history.building_master(community)
+        if saved is None:
+            catalog = self.default_catalog()
+            return Checklist(catalog, due_item_ids(catalog, day))
+
+        catalog = self.catalog_for_building(*saved)
+        plan = self.history.plan_for(community, day.isoformat())
+        if plan is not None and plan[0] == catalog.key:
+            return Checklist(catalog, plan[1])
+
+        rows = _plan_rows(normalize_key(community), catalog, day, 1)
+        self.history.save_plans(rows)
+        return Checklist(catalog, json.loads(rows[0][3]))
@@ -0,0 +1,296 @@
+"""
+Inspección compartida entre las sesiones del proceso (y la API de ingesta): estado por ítem con
+versiones, feed de cambios y registro de inspecciones abiertas. Sin dependencias de Streamlit.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, date
+
+from planning import is_due
+from storage import HistoryStore, PhotoStore, normalize_key
+
+ITEM_SHARED_FIELDS = ("status", "note", "photo")
+SHARED_FEED_MAX = 5000             # deltas retenidos por inspección
+SHARED_IDLE_SECONDS = 15 * 60      # sin sesiones ni API por este tiempo, la inspección sale de memoria
+INGEST_IDEMPOTENCY_KEYS = 10000    # llaves de idempotencia recordadas
+
+
+class SharedInspection:
+    """
+    Estado compartido de una inspección (comunidad + fecha) entre todas las sesiones del proceso.
+    Cada ítem (por nombre normalizado) lleva una versión y la versión en que cambió cada campo.
+    Una escritura indica la versión que la sesión alcanzó a ver: los campos que otro modificó
+    después quedan en conflicto (se mantiene el valor remoto) y el resto se fusiona.
+    Cada cambio se registra en un feed con número de secuencia para que las demás sesiones
+    apliquen sólo los deltas.
+    """
+
+    def __init__(self, community: str, day: str, title: str, history: HistoryStore, saved=None):
+        self.community = community
+        self.day = day
+        self.title = title      # nombre de la comunidad tal como se escribió
+        self.epoch = uuid.uuid4().hex   # distingue una recarga tras salir de memoria (seq vuelve a 0)
+        self.last_used = time.monotonic()
+        self.seq = 0
+        self._history = history
+        self._lock = threading.Lock()
+        self._items = {}        # key -> {name, cat, task, status, note, photo (ref), version, field_versions}
+        self._incidences = {}   # id -> {id, employee, detail, ts}
+        self._next_inc_id = 1
+        self._needs = ""
+        self._needs_version = 0
+        self._feed = []         # deltas: {seq, kind, key, fields, version, by}
+        self._feed_base = 1     # seq del primer delta retenido en _feed
+
+        # retoma lo guardado en el historial (p. ej. tras reiniciar la app)
+        if saved:
+            for key, it in saved["items"].items():
+                self._items[key] = {**it, "version": 0, "field_versions": {}}
+            for inc in saved["incidences"]:
+                self._incidences[inc["id"]] = inc
+            self._next_inc_id = max(self._incidences, default=0) + 1
+            self._needs = saved["needs"]
+
+    def _emit(self, kind: str, key, fields: dict, version: int, by: str):
+        self.seq += 1
+        self._feed.append({"seq": self.seq, "kind": kind, "key": key, "fields": fields, "version": version, "by": by})
+        # se recorta en bloque para no mover la lista en cada escritura
+        if len(self._feed) > 2 * SHARED_FEED_MAX:
+            drop = len(self._feed) - SHARED_FEED_MAX
+            del self._feed[:drop]
+            self._feed_base += drop
+
+    def write_item(self, key: str, name: str, fields: dict, expected_version, by: str, cat=None, task=None):
+        """
+        Escribe campos de un ítem. expected_version=None escribe sin control (ingesta automática).
+        cat/task (si se conocen) sólo se usan para el historial.
+        Retorna (versión vigente, valores vigentes, campos en conflicto).
+        """
+        with self._lock:
+            cur = self._items.get(key)
+            if cur is None:
+                cur = self._items[key] = {
+                    "name": name, "cat": None, "task": None, "status": "pending", "note": "", "photo": None,
+                    "version": 0, "field_versions": {},
+                }
+            cur["cat"] = cat or cur["cat"]
+            cur["task"] = task or cur["task"]
+
+            applied, conflicts = {}, []
+            for f, v in fields.items():
+                if cur[f] == v:
+                    continue
+                if expected_version is not None and cur["field_versions"].get(f, 0) > expected_version:
+                    conflicts.append(f)
+                    continue
+                applied[f] = v
+
+            if applied:
+                cur["version"] += 1
+                for f, v in applied.items():
+                    cur[f] = v
+                    cur["field_versions"][f] = cur["version"]
+                self._emit("item", key, applied, cur["version"], by)
+                self._history.record_item(self.title, self.day, key, cur)
+
+            return cur["version"], {f: cur[f] for f in ITEM_SHARED_FIELDS}, conflicts
+
+    def add_incidence(self, employee: str, detail: str, ts: datetime, by: str) -> dict:
+        with self._lock:
+            inc = {"id": self._next_inc_id, "employee": employee, "detail": detail, "ts": ts}
+            self._next_inc_id += 1
+            self._incidences[inc["id"]] = inc
+            self._emit("inc_add", inc["id"], inc, 0, by)
+            self._history.record_incidence(self.title, self.day, inc)
+            return inc
+
+    def delete_incidence(self, inc_id: int, by: str):
+        with self._lock:
+            if self._incidences.pop(inc_id, None) is not None:
+                self._emit("inc_del", inc_id, {}, 0, by)
+                self._history.delete_incidence(self.title, self.day, inc_id)
+
+    def write_needs(self, text: str, expected_version, by: str):
+        """
+        expected_version=None escribe sin control (restauración de respaldo).
+        Retorna (versión vigente, texto vigente, hubo_conflicto).
+        """
+        with self._lock:
+            if text == self._needs:
+                return self._needs_version, self._needs, False
+            if expected_version is not None and self._needs_version > expected_version:
+                return self._needs_version, self._needs, True
+            self._needs = text
+            self._needs_version += 1
+            self._emit("needs", None, {"needs": text}, self._needs_version, by)
+            self._history.record_needs(self.title, self.day, text)
+            return self._needs_version, self._needs, False
+
+    def changes_since(self, seq: int):
+        """
+        Retorna (seq actual, deltas posteriores a seq). Los deltas son None si seq
+        ya salió del feed y la sesión debe recargar el snapshot completo.
+        """
+        with self._lock:
+            if seq >= self.seq:
+                return self.seq, []
+            if seq + 1 < self._feed_base:
+                return self.seq, None
+            return self.seq, self._feed[seq + 1 - self._feed_base:]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "seq": self.seq,
+                "items": {k: {**v, "field_versions": dict(v["field_versions"])} for k, v in self._items.items()},
+                "incidences": list(self._incidences.values()),
+                "needs": self._needs,
+                "needs_version": self._needs_version,
+            }
+
+
+class SharedStore:
+    """
+    Registro de inspecciones compartidas del proceso (una por comunidad + fecha).
+    Cada inspección tiene su propio lock: guardias de edificios distintos no compiten entre sí.
+    Las que nadie usa hace SHARED_IDLE_SECONDS salen de memoria; al volver a abrirlas se
+    recargan desde el historial (las sesiones abiertas polean cada pocos segundos y las mantienen).
+    catalog_for(comunidad): datos maestros vigentes del edificio, para validar lo que llega por la API.
+    """
+
+    def __init__(self, photos: PhotoStore, history: HistoryStore, catalog_for):
+        self.photos = photos
+        self.history = history
+        self.catalog_for = catalog_for
+        self._lock = threading.Lock()
+        self._inspections = {}
+        self._loading = {}             # key -> Event mientras se carga (fuera del lock global)
+        self._last_sweep = time.monotonic()
+        self._idem_lock = threading.Lock()
+        self._applying = {}            # idempotency_key -> Event mientras se aplica su lote
+        self._results = OrderedDict()  # idempotency_key -> respuesta reciente (el historial guarda todas)
+
+    def _evict_idle(self, now: float):
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        for key in [k for k, insp in self._inspections.items() if now - insp.last_used > SHARED_IDLE_SECONDS]:
+            del self._inspections[key]
+
+    def inspection(self, community: str, day: date) -> SharedInspection:
+        key = (normalize_key(community), day.isoformat())
+        now = time.monotonic()
+        insp = self._inspections.get(key)
+        if insp is not None:
+            insp.last_used = now
+            return insp
+
+        with self._lock:
+            self._evict_idle(now)
+            insp = self._inspections.get(key)
+            if insp is not None:
+                insp.last_used = now
+                return insp
+            loading = self._loading.get(key)
+            owner = loading is None
+            if owner:
+                loading = self._loading[key] = threading.Event()
+
+        if not owner:
+            # otra sesión la está cargando: se espera sólo a esa inspección
+            loading.wait()
+            return self.inspection(community, day)
+
+        insp = None
+        try:
+            insp = SharedInspection(
+                *key, title=" ".join(community.split()), history=self.history,
+                saved=self.history.load_inspection(*key),
+            )
+        finally:
+            with self._lock:
+                if insp is not None:
+                    self._inspections[key] = insp
+                del self._loading[key]
+            loading.set()
+        return insp
+
+    def unknown_items(self, batch: dict) -> list:
+        """
+        Instalaciones del lote que no están en los datos maestros del edificio (o en los de
+        por defecto si aún no tiene propios): no aparecerían en ningún checklist.
+        """
+        known = {normalize_key(x["name"]) for x in self.catalog_for(batch["community"]).items}
+        return [upd["name"] for key, upd in batch["items"].items() if key not in known]
+
+    def not_due_items(self, batch: dict) -> list:
+        """
+        Instalaciones del lote que según su frecuencia no tocan en la fecha del lote: no
+        aparecerían en el checklist de ese día (ver planning.is_due).
+        """
+        freq = {normalize_key(x["name"]): x["freq"] for x in self.catalog_for(batch["community"]).items}
+        return [
+            upd["name"] for key, upd in batch["items"].items()
+            if key in freq and not is_due(freq[key], batch["date"])
+        ]
+
+    def ingest(self, batches, idempotency_keys) -> list:
+        """
+        Aplica lotes validados (ver ingest.parse_ingest_batch). Los lotes con una llave de
+        idempotencia ya vista no se vuelven a aplicar: se responde lo mismo que la primera vez.
+        Las llaves se guardan en el historial (sobreviven a un reinicio) y cada una se reserva
+        sólo mientras se aplica su lote: dos requests con la misma llave no lo aplican dos veces
+        y los lotes con llaves distintas no se esperan entre sí.
+        """
+        return [self._ingest_batch(batch, key) for batch, key in zip(batches, idempotency_keys)]
+
+    def _ingest_batch(self, batch: dict, key: str) -> dict:
+        if not key:
+            return self._apply_batch(batch)
+
+        while True:
+            with self._idem_lock:
+                res = self._results.get(key)
+                applying = self._applying.get(key)
+                owner = res is None and applying is None
+                if owner:
+                    applying = self._applying[key] = threading.Event()
+            if res is not None:
+                return {**res, "replayed": True}
+            if owner:
+                break
+            # otro request con la misma llave la está aplicando: se espera su respuesta
+            applying.wait()
+
+        try:
+            res = self.history.ingest_result(key)
+            replayed = res is not None
+            if not replayed:
+                res = self._apply_batch(batch)
+                self.history.record_ingest_result(key, res, INGEST_IDEMPOTENCY_KEYS)
+            with self._idem_lock:
+                self._results[key] = res
+                while len(self._results) > INGEST_IDEMPOTENCY_KEYS:
+                    self._results.popitem(last=False)
+        finally:
+            with self._idem_lock:
+                del self._applying[key]
+            applying.set()
+        return {**res, "replayed": True} if replayed else res
+
+    def _apply_batch(self, batch: dict) -> dict:
+        insp = self.inspection(batch["community"], batch["date"])
+        for item_key, upd in batch["items"].items():
+            fields = {f: upd[f] for f in ITEM_SHARED_FIELDS if f in upd}
+            if "photo" in fields:
+                fields["photo"] = self.photos.put(fields["photo"])
+            insp.write_item(item_key, upd["name"], fields, None, "api")
+        for inc in batch["incidences"]:
+            insp.add_incidence(inc["employee"], inc["detail"], inc["ts"], "api")
+        return {
+            "seq": insp.seq,
+            "items": len(batch["items"]),
+            "incidences": len(batch["incidences"]),
+        }
@@ -0,0 +1,1091 @@
+"""
+Almacenamiento local: fotos por hash, historial en SQLite (con índice FTS5 y conteos
+preagregados) y archivo frío por mes en ZIP. Sin dependencias de Streamlit.
+"""
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
+from datetime import datetime, date
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+HISTORY_BATCH_MAX = 500            # cambios por transacción del escritor de historial
+HISTORY_BUSY_SECONDS = 30          # espera de SQLite si otra conexión tiene la base bloqueada
+HISTORY_RETRY_SECONDS = 1          # primera espera extra del escritor si sigue bloqueada (se duplica)
+HISTORY_RETRY_MAX_SECONDS = 60
+ARCHIVE_PHOTO_MAX_PX = 1280        # lado mayor de las fotos archivadas
+ARCHIVE_PHOTO_QUALITY = 60         # calidad JPEG de las fotos archivadas
+ARCHIVE_PHOTO_GRACE_SECONDS = 24 * 3600   # fotos sin referencia más nuevas que esto no se borran
+
+
+def normalize_key(text) -> str:
+    """
+    Normaliza nombres (instalación / comunidad) para compararlos sin importar mayúsculas ni espacios.
+    """
+    return " ".join(str(text or "").split()).lower()
+
+
+# ---------------------------
+# Fotos (por hash)
+# ---------------------------
+class PhotoStore:
+    """
+    Fotos guardadas una sola vez en disco, direccionadas por su hash (sha256).
+    Ítems, sesiones e inspección compartida guardan sólo la referencia.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, ref: str) -> Path:
+        return self.root / ref[:2] / ref
+
+    def put(self, data: bytes) -> str:
+        ref = hashlib.sha256(data).hexdigest()
+        p = self.path(ref)
+        if p.exists():
+            os.utime(p)  # recién usada: la limpieza de fotos sin referencia no la toca
+        else:
+            p.parent.mkdir(exist_ok=True)
+            tmp = p.with_name(f"{ref}.{uuid.uuid4().hex}.tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, p)
+        return ref
+
+    def has(self, ref) -> bool:
+        return bool(ref) and re.fullmatch(r"[0-9a-f]{64}", ref) is not None and self.path(ref).exists()
+
+    def put_stream(self, src) -> str:
+        """
+        Guarda una foto leyéndola por bloques (sin cargarla entera en memoria) y retorna su ref.
+        """
+        h = hashlib.sha256()
+        tmp = self.root / f"{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as out:
+            for block in iter(lambda: src.read(1024 * 1024), b""):
+                h.update(block)
+                out.write(block)
+        ref = h.hexdigest()
+        p = self.path(ref)
+        if p.exists():
+            tmp.unlink()
+            os.utime(p)
+        else:
+            p.parent.mkdir(exist_ok=True)
+            os.replace(tmp, p)
+        return ref
+
+    def get(self, ref):
+        if not ref:
+            return None
+        try:
+            return self.path(ref).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def remove_unreferenced(self, keep: set, grace_seconds: float) -> int:
+        """
+        Borra las fotos que no están en 'keep' y no se usaron en los últimos grace_seconds
+        (el margen cubre fotos recién subidas cuyo ítem aún no llega al historial).
+        """
+        limit = time.time() - grace_seconds
+        removed = 0
+        for p in self.root.glob("??/*"):
+            if p.name not in keep and p.stat().st_mtime < limit:
+                p.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+
+# ---------------------------
+# Historial persistente (SQLite) + búsqueda de texto completo (FTS5)
+# ---------------------------
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS inspections (
+    community_key TEXT NOT NULL,
+    day TEXT NOT NULL,
+    community TEXT NOT NULL,
+    needs TEXT NOT NULL DEFAULT '',
+    rev INTEGER NOT NULL DEFAULT 0,     -- sube con cada cambio (ítems, incidencias, requerimientos)
+    PRIMARY KEY (community_key, day)
+);
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    community_key TEXT NOT NULL,
+    day TEXT NOT NULL,
+    key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    cat TEXT,
+    task TEXT,
+    status TEXT NOT NULL,
+    note TEXT NOT NULL,
+    photo TEXT,
+    updated_at TEXT NOT NULL,
+    UNIQUE (community_key, day, key)
+);
+CREATE TABLE IF NOT EXISTS incidences (
+    id INTEGER PRIMARY KEY,
+    community_key TEXT NOT NULL,
+    day TEXT NOT NULL,
+    inc_id INTEGER NOT NULL,
+    employee TEXT NOT NULL,
+    detail TEXT NOT NULL,
+    ts TEXT NOT NULL,
+    UNIQUE (community_key, day, inc_id)
+);
+CREATE INDEX IF NOT EXISTS items_fail_day ON items (day) WHERE status = 'fail';
+-- analítica: conteos preagregados que se mantienen en cada escritura
+CREATE TABLE IF NOT EXISTS installations (
+    id INTEGER PRIMARY KEY,
+    community_key TEXT NOT NULL,
+    key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    cat TEXT NOT NULL DEFAULT '',
+    UNIQUE (community_key, key)
+);
+CREATE TABLE IF NOT EXISTS daily_rollup (
+    day TEXT NOT NULL,
+    community_key TEXT NOT NULL,
+    ok INTEGER NOT NULL DEFAULT 0,
+    fail INTEGER NOT NULL DEFAULT 0,
+    pending INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, community_key)
+);
+CREATE TABLE IF NOT EXISTS item_monthly (
+    month TEXT NOT NULL,
+    inst_id INTEGER NOT NULL,
+    ok INTEGER NOT NULL DEFAULT 0,
+    fail INTEGER NOT NULL DEFAULT 0,
+    pending INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (month, inst_id)
+);
+-- planificación: datos maestros vigentes por edificio e índice de ítems que corresponden por día
+CREATE TABLE IF NOT EXISTS building_masters (
+    community_key TEXT PRIMARY KEY,
+    community TEXT NOT NULL,
+    catalog_key TEXT NOT NULL,
+    rows TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS plan_due (
+    day TEXT NOT NULL,
+    community_key TEXT NOT NULL,
+    catalog_key TEXT NOT NULL,
+    item_ids TEXT NOT NULL,
+    PRIMARY KEY (day, community_key)
+);
+-- API de ingesta: respuesta ya entregada por llave de idempotencia (se conservan las más recientes)
+CREATE TABLE IF NOT EXISTS ingest_results (
+    key TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+-- rowid = items.id para ítems y -incidences.id para incidencias
+CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5(
+    kind UNINDEXED, community_key UNINDEXED, community UNINDEXED, day UNINDEXED,
+    name, task, note, employee, detail,
+    tokenize = "unicode61 remove_diacritics 2"
+);
+-- archivo: índice liviano de lo que se movió a los ZIP mensuales (ver ArchiveStore)
+CREATE TABLE IF NOT EXISTS archive_index (
+    community_key TEXT NOT NULL,
+    day TEXT NOT NULL,
+    community TEXT NOT NULL,
+    month TEXT NOT NULL,
+    items INTEGER NOT NULL,
+    fail INTEGER NOT NULL,
+    photos INTEGER NOT NULL,
+    statuses TEXT NOT NULL DEFAULT '{}',   -- {key: estado} para descontar de los conteos si se vuelve a editar
+    PRIMARY KEY (community_key, day)
+);
+CREATE TABLE IF NOT EXISTS archive_fail_days (
+    inst_id INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    PRIMARY KEY (inst_id, day)
+) WITHOUT ROWID;
+CREATE VIRTUAL TABLE IF NOT EXISTS archive_search USING fts5(
+    kind UNINDEXED, community_key UNINDEXED, community UNINDEXED, day UNINDEXED,
+    name, task, note, employee, detail,
+    tokenize = "unicode61 remove_diacritics 2"
+);
+"""
+
+
+ROLLUP_BACKFILL = """
+INSERT OR IGNORE INTO installations (community_key, key, name, cat)
+SELECT community_key, key, name, COALESCE(cat, '') FROM items;
+INSERT INTO daily_rollup (day, community_key, ok, fail, pending)
+SELECT day, community_key, sum(status = 'ok'), sum(status = 'fail'), sum(status = 'pending')
+FROM items GROUP BY day, community_key;
+INSERT INTO item_monthly (month, inst_id, ok, fail, pending)
+SELECT substr(it.day, 1, 7), i.id, sum(it.status = 'ok'), sum(it.status = 'fail'), sum(it.status = 'pending')
+FROM items it JOIN installations i ON i.community_key = it.community_key AND i.key = it.key
+GROUP BY substr(it.day, 1, 7), i.id;
+"""
+
+
+def build_fts_query(text: str) -> str:
+    """
+    Convierte texto libre en una consulta FTS5: todas las palabras (AND), cada una como prefijo.
+    Los acentos se ignoran por el tokenizador (remove_diacritics).
+    """
+    tokens = re.findall(r"\w+", (text or "").lower())
+    return " AND ".join(f'"{t}"*' for t in tokens)
+
+
+class HistoryStore:
+    """
+    Historial de inspecciones e incidencias en SQLite, con índice FTS5 actualizado en cada escritura.
+    Las escrituras se encolan y un hilo las aplica en lotes (una transacción por lote), así la
+    inspección compartida nunca espera al disco.
+    archive / photos: archivo mensual (ArchiveStore) y fotos; con ellos, la primera escritura sobre
+    una fecha archivada la devuelve completa a las tablas en caliente (ver _unarchive).
+    """
+
+    def __init__(self, path: Path, archive=None, photos: PhotoStore = None):
+        self.path = path
+        self.archive = archive
+        self.photos = photos
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        conn.executescript(HISTORY_SCHEMA)
+        with conn:
+            # historial anterior a la revisión por inspección
+            if "rev" not in {c[1] for c in conn.execute("PRAGMA table_info(inspections)")}:
+                conn.execute("ALTER TABLE inspections ADD COLUMN rev INTEGER NOT NULL DEFAULT 0")
+            # historial anterior a los conteos preagregados: se calculan una vez
+            if conn.execute("SELECT count(*) FROM installations").fetchone()[0] == 0:
+                conn.executescript(ROLLUP_BACKFILL)
+        conn.close()
+        self._queue = queue.Queue()
+        threading.Thread(target=self._writer, name="history-writer", daemon=True).start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=HISTORY_BUSY_SECONDS)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # --- escrituras (encoladas) ---
+    def record_item(self, community: str, day: str, key: str, item: dict):
+        self._queue.put(("item", (community, day, key, dict(item), datetime.now().isoformat(timespec="seconds"))))
+
+    def record_incidence(self, community: str, day: str, inc: dict):
+        self._queue.put(("incidence", (community, day, dict(inc))))
+
+    def delete_incidence(self, community: str, day: str, inc_id: int):
+        self._queue.put(("incidence_del", (community, day, inc_id)))
+
+    def record_needs(self, community: str, day: str, needs: str):
+        self._queue.put(("needs", (community, day, needs)))
+
+    def record_ingest_result(self, key: str, result: dict, keep: int):
+        """
+        Va por la misma cola que los cambios del lote, así nunca queda guardada antes que ellos.
+        """
+        self._queue.put(("ingest_result", (key, dict(result), keep)))
+
+    def flush(self):
+        """
+        Espera a que todas las escrituras encoladas estén en disco.
+        """
+        self._queue.join()
+
+    def _writer(self):
+        conn = self._connect()
+        while True:
+            ops = [self._queue.get()]
+            while len(ops) < HISTORY_BATCH_MAX:
+                try:
+                    ops.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                try:
+                    self._commit(conn, ops)
+                except Exception:
+                    # un cambio que falla no se lleva el lote: se reintenta uno por transacción
+                    for op in ops:
+                        try:
+                            self._commit(conn, [op])
+                        except Exception:
+                            # el hilo no puede morir: sin él las escrituras se encolan para siempre
+                            logger.exception("No se pudo guardar un cambio del historial (%s); se descarta.", op[0])
+            finally:
+                for _ in ops:
+                    self._queue.task_done()
+
+    def _commit(self, conn, ops: list):
+        """
+        Aplica los cambios en una transacción. Si la base sigue bloqueada por otra conexión
+        (más allá de HISTORY_BUSY_SECONDS) se reintenta con esperas crecientes, sin descartar nada.
+        """
+        delay = HISTORY_RETRY_SECONDS
+        while True:
+            try:
+                with conn:
+                    for kind, args in ops:
+                        getattr(self, f"_apply_{kind}")(conn, *args)
+                return
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) and "busy" not in str(e):
+                    raise
+                logger.warning("Historial bloqueado (%s); se reintenta en %s s.", e, delay)
+                time.sleep(delay)
+                delay = min(delay * 2, HISTORY_RETRY_MAX_SECONDS)
+
+    def _ensure_inspection(self, conn, community: str, day: str):
+        """
+        Crea la fila de la inspección si falta y sube su revisión (todo cambio pasa por aquí).
+        Si la fecha estaba archivada, antes la trae completa de vuelta (ver _unarchive).
+        """
+        conn.execute(
+            "INSERT OR IGNORE INTO inspections (community_key, day, community) VALUES (?, ?, ?)",
+            (normalize_key(community), day, community),
+        )
+        conn.execute(
+            "UPDATE inspections SET rev = rev + 1 WHERE community_key = ? AND day = ?",
+            (normalize_key(community), day),
+        )
+        self._unarchive(conn, community, day)
+
+    def _unarchive(self, conn, community: str, day: str):
+        """
+        Copia a las tablas en caliente todo lo archivado de la fecha (lo que ya esté en caliente
+        gana) y la saca del índice de archivo. Desde ahí la copia en caliente es la única que vale:
+        borrar una incidencia o vaciar los requerimientos ya no reaparece al recargar, y el
+        próximo archivo reemplaza la fecha en su ZIP. Los conteos preagregados no cambian: ya
+        incluían lo archivado.
+        Si el ZIP no se puede leer, la fecha sigue archivada y cada ítem que se edite descuenta
+        su estado archivado (ver _archived_status).
+        """
+        ckey = normalize_key(community)
+        row = conn.execute(
+            "SELECT month FROM archive_index WHERE community_key = ? AND day = ?", (ckey, day)
+        ).fetchone()
+        if row is None or self.archive is None:
+            return
+        rec = self.archive.read_inspection(row[0], ckey, day, self.photos)
+        if rec is None:
+            return
+
+        hot_items = {key for (key,) in conn.execute(
+            "SELECT key FROM items WHERE community_key = ? AND day = ?", (ckey, day)
+        )}
+        hot_incs = {inc_id for (inc_id,) in conn.execute(
+            "SELECT inc_id FROM incidences WHERE community_key = ? AND day = ?", (ckey, day)
+        )}
+        updated_at = datetime.now().isoformat(timespec="seconds")
+        for key, it in rec["items"].items():
+            if key in hot_items:
+                continue
+            cur = conn.execute(
+                "INSERT INTO items (community_key, day, key, name, cat, task, status, note, photo, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (ckey, day, key, it["name"], it["cat"], it["task"], it["status"], it["note"], it["photo"], updated_at),
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO installations (community_key, key, name, cat) VALUES (?, ?, ?, ?)",
+                (ckey, key, it["name"], it["cat"] or ""),
+            )
+            conn.execute(
+                "INSERT INTO search (rowid, kind, community_key, community, day, name, task, note, employee, detail) "
+                "VALUES (?, 'item', ?, ?, ?, ?, ?, ?, '', '')",
+                (cur.lastrowid, ckey, community, day, it["name"], it["task"] or "", it["note"]),
+            )
+        for inc in rec["incidences"]:
+            if inc["id"] in hot_incs:
+                continue
+            cur = conn.execute(
+                "INSERT INTO incidences (community_key, day, inc_id, employee, detail, ts) VALUES (?, ?, ?, ?, ?, ?)",
+                (ckey, day, inc["id"], inc["employee"], inc["detail"], inc["ts"].isoformat(timespec="seconds")),
+            )
+            conn.execute(
+                "INSERT INTO search (rowid, kind, community_key, community, day, name, task, note, employee, detail) "
+                "VALUES (?, 'incidence', ?, ?, ?, '', '', '', ?, ?)",
+                (-cur.lastrowid, ckey, community, day, inc["employee"], inc["detail"]),
+            )
+        conn.execute(
+            "UPDATE inspections SET needs = ? WHERE community_key = ? AND day = ? AND needs = ''",
+            (rec["needs"], ckey, day),
+        )
+
+        conn.execute("DELETE FROM archive_search WHERE community_key = ? AND day = ?", (ckey, day))
+        conn.execute(
+            "DELETE FROM archive_fail_days WHERE day = ? AND inst_id IN "
+            "(SELECT id FROM installations WHERE community_key = ?)",
+            (day, ckey),
+        )
+        conn.execute("DELETE FROM archive_index WHERE community_key = ? AND day = ?", (ckey, day))
+
+    def _bump_rollups(self, conn, ckey: str, day: str, inst_id: int, status: str, delta: int):
+        if status not in ("ok", "fail", "pending"):
+            return
+        conn.execute("INSERT OR IGNORE INTO daily_rollup (day, community_key) VALUES (?, ?)", (day, ckey))
+        conn.execute(
+            f"UPDATE daily_rollup SET {status} = {status} + ? WHERE day = ? AND community_key = ?",
+            (delta, day, ckey),
+        )
+        conn.execute("INSERT OR IGNORE INTO item_monthly (month, inst_id) VALUES (?, ?)", (day[:7], inst_id))
+        conn.execute(
+            f"UPDATE item_monthly SET {status} = {status} + ? WHERE month = ? AND inst_id = ?",
+            (delta, day[:7], inst_id),
+        )
+
+    def _apply_item(self, conn, community, day, key, it, updated_at):
+        ckey = normalize_key(community)
+        self._ensure_inspection(conn, community, day)
+        prev = conn.execute(
+            "SELECT status FROM items WHERE community_key = ? AND day = ? AND key = ?",
+            (ckey, day, key),
+        ).fetchone() or self._archived_status(conn, ckey, day, key)
+        conn.execute(
+            """
+            INSERT INTO items (community_key, day, key, name, cat, task, status, note, photo, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (community_key, day, key) DO UPDATE SET
+                name = excluded.name,
+                cat = COALESCE(excluded.cat, items.cat),
+                task = COALESCE(excluded.task, items.task),
+                status = excluded.status,
+                note = excluded.note,
+                photo = excluded.photo,
+                updated_at = excluded.updated_at
+            """,
+            (ckey, day, key, it["name"], it.get("cat"), it.get("task"),
+             it["status"], it["note"], it["photo"], updated_at),
+        )
+        rowid, name, cat, task, note, status = conn.execute(
+            "SELECT id, name, cat, task, note, status FROM items WHERE community_key = ? AND day = ? AND key = ?",
+            (ckey, day, key),
+        ).fetchone()
+        conn.execute(
+            """
+            INSERT INTO installations (community_key, key, name, cat) VALUES (?, ?, ?, ?)
+            ON CONFLICT (community_key, key) DO UPDATE SET
+                name = excluded.name,
+                cat = CASE WHEN excluded.cat = '' THEN installations.cat ELSE excluded.cat END
+            """,
+            (ckey, key, name, cat or ""),
+        )
+        if prev is None or prev[0] != status:
+            inst_id = conn.execute(
+                "SELECT id FROM installations WHERE community_key = ? AND key = ?", (ckey, key)
+            ).fetchone()[0]
+            if prev is not None:
+                self._bump_rollups(conn, ckey, day, inst_id, prev[0], -1)
+            self._bump_rollups(conn, ckey, day, inst_id, status, +1)
+        conn.execute("DELETE FROM search WHERE rowid = ?", (rowid,))
+        conn.execute(
+            "INSERT INTO search (rowid, kind, community_key, community, day, name, task, note, employee, detail) "
+            "VALUES (?, 'item', ?, ?, ?, ?, ?, ?, '', '')",
+            (rowid, ckey, community, day, name, task or "", note),
+        )
+
+    def _archived_status(self, conn, ckey: str, day: str, key: str):
+        """
+        Estado archivado de un ítem que vuelve a editarse en caliente, como (estado,) o None.
+        Desde ahora la fila en caliente es la que cuenta: su día con FALLA archivado se descarta.
+        """
+        row = conn.execute(
+            "SELECT statuses FROM archive_index WHERE community_key = ? AND day = ?", (ckey, day)
+        ).fetchone()
+        status = json.loads(row[0]).get(key) if row else None
+        if status is None:
+            return None
+        conn.execute(
+            "DELETE FROM archive_fail_days WHERE day = ? AND inst_id IN "
+            "(SELECT id FROM installations WHERE community_key = ? AND key = ?)",
+            (day, ckey, key),
+        )
+        return (status,)
+
+    def _apply_incidence(self, conn, community, day, inc):
+        ckey = normalize_key(community)
+        self._ensure_inspection(conn, community, day)
+        self._apply_incidence_del(conn, community, day, inc["id"])
+        cur = conn.execute(
+            "INSERT INTO incidences (community_key, day, inc_id, employee, detail, ts) VALUES (?, ?, ?, ?, ?, ?)",
+            (ckey, day, inc["id"], inc["employee"], inc["detail"], inc["ts"].isoformat(timespec="seconds")),
+        )
+        conn.execute(
+            "INSERT INTO search (rowid, kind, community_key, community, day, name, task, note, employee, detail) "
+            "VALUES (?, 'incidence', ?, ?, ?, '', '', '', ?, ?)",
+            (-cur.lastrowid, ckey, community, day, inc["employee"], inc["detail"]),
+        )
+
+    def _apply_incidence_del(self, conn, community, day, inc_id):
+        self._ensure_inspection(conn, community, day)
+        row = conn.execute(
+            "SELECT id FROM incidences WHERE community_key = ? AND day = ? AND inc_id = ?",
+            (normalize_key(community), day, inc_id),
+        ).fetchone()
+        if row:
+            conn.execute("DELETE FROM incidences WHERE id = ?", row)
+            conn.execute("DELETE FROM search WHERE rowid = ?", (-row[0],))
+
+    def _apply_needs(self, conn, community, day, needs):
+        self._ensure_inspection(conn, community, day)
+        conn.execute(
+            "UPDATE inspections SET needs = ? WHERE community_key = ? AND day = ?",
+            (needs, normalize_key(community), day),
+        )
+
+    def _apply_ingest_result(self, conn, key, result, keep):
+        conn.execute(
+            "INSERT OR REPLACE INTO ingest_results (key, result, created_at) VALUES (?, ?, ?)",
+            (key, json.dumps(result), datetime.now().isoformat(timespec="seconds")),
+        )
+        conn.execute(
+            "DELETE FROM ingest_results WHERE rowid <= (SELECT max(rowid) FROM ingest_results) - ?", (keep,)
+        )
+
+    # --- lecturas ---
+    def load_inspection(self, community_key: str, day: str):
+        """
+        Estado guardado de una inspección (para retomarla tras reiniciar la app), o None.
+        Si la fecha está archivada, se lee de su ZIP (con lo que haya en caliente encima).
+        """
+        saved = self._load_hot(community_key, day)
+        month = self.archived_month(community_key, day) if self.archive is not None else None
+        if month:
+            archived = self.archive.read_inspection(month, community_key, day, self.photos)
+            if archived:
+                saved = merge_archived(archived, saved) if saved else archived
+        return saved
+
+    def _load_hot(self, community_key: str, day: str):
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT needs FROM inspections WHERE community_key = ? AND day = ?", (community_key, day)
+            ).fetchone()
+            if row is None:
+                return None
+            items = {
+                key: {"name": name, "cat": cat, "task": task, "status": status, "note": note, "photo": photo}
+                for key, name, cat, task, status, note, photo in conn.execute(
+                    "SELECT key, name, cat, task, status, note, photo FROM items WHERE community_key = ? AND day = ?",
+                    (community_key, day),
+                )
+            }
+            incidences = [
+                {"id": inc_id, "employee": employee, "detail": detail, "ts": datetime.fromisoformat(ts)}
+                for inc_id, employee, detail, ts in conn.execute(
+                    "SELECT inc_id, employee, detail, ts FROM incidences WHERE community_key = ? AND day = ?",
+                    (community_key, day),
+                )
+            ]
+            return {"needs": row[0], "items": items, "incidences": incidences}
+        finally:
+            conn.close()
+
+    def ingest_result(self, key: str):
+        """
+        Respuesta ya entregada para una llave de idempotencia de la API, o None.
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT result FROM ingest_results WHERE key = ?", (key,)).fetchone()
+        finally:
+            conn.close()
+        return json.loads(row[0]) if row else None
+
+    def search(self, text: str, community: str = "", kind: str = "", page: int = 1, page_size: int = 20):
+        """
+        Búsqueda rankeada (bm25) sobre observaciones, instalaciones, tareas e incidencias.
+        Retorna (total, resultados de la página).
+        """
+        query = build_fts_query(text)
+        if not query:
+            return 0, []
+
+        filters = ""
+        params = [query]
+        if community:
+            filters += " AND community_key = ?"
+            params.append(normalize_key(community))
+        if kind:
+            filters += " AND kind = ?"
+            params.append(kind)
+
+        # lo archivado sigue apareciendo, marcado (archived = 1)
+        tables = (("search", 0), ("archive_search", 1))
+        conn = self._connect()
+        try:
+            total = sum(
+                conn.execute(f"SELECT count(*) FROM {t} WHERE {t} MATCH ?{filters}", params).fetchone()[0]
+                for t, _ in tables
+            )
+            rows = conn.execute(
+                " UNION ALL ".join(
+                    f"""
+                    SELECT kind, community, day, name, task, employee,
+                           snippet({t}, -1, '**', '**', '…', 12), {archived}, bm25({t}) AS rank
+                    FROM {t} WHERE {t} MATCH ?{filters}
+                    """
+                    for t, archived in tables
+                )
+                + " ORDER BY rank LIMIT ? OFFSET ?",
+                params * len(tables) + [page_size, (max(page, 1) - 1) * page_size],
+            ).fetchall()
+        finally:
+            conn.close()
+
+        keys = ("kind", "community", "day", "name", "task", "employee", "snippet", "archived")
+        return total, [dict(zip(keys, r)) for r in rows]
+
+    def _analytics_query(self, sql: str, params: list, dtype):
+        conn = self._connect()
+        try:
+            return np.fromiter(conn.execute(sql, params), dtype=dtype)
+        finally:
+            conn.close()
+
+    def installation_totals(self, since_month: str, community: str = ""):
+        """
+        Conteos por instalación desde 'since_month' (AAAA-MM), desde item_monthly.
+        """
+        sql = (
+            "SELECT i.id, i.community_key, i.name, i.cat, sum(m.ok), sum(m.fail) "
+            "FROM item_monthly m JOIN installations i ON i.id = m.inst_id WHERE m.month >= ?"
+        )
+        params = [since_month]
+        if community:
+            sql += " AND i.community_key = ?"
+            params.append(normalize_key(community))
+        sql += " GROUP BY i.id"
+        dtype = [("id", "i8"), ("comm", "O"), ("name", "O"), ("cat", "O"), ("ok", "i8"), ("fail", "i8")]
+        return self._analytics_query(sql, params, dtype)
+
+    def fail_days(self, since: str, community: str = ""):
+        """
+        Días (julianos) con FALLA por instalación desde 'since' (ISO), para MTBF y rachas.
+        """
+        hot = (
+            "SELECT i.id, CAST(julianday(it.day) AS INTEGER) FROM items it "
+            "JOIN installations i ON i.community_key = it.community_key AND i.key = it.key "
+            "WHERE it.status = 'fail' AND it.day >= ?"
+        )
+        archived = (
+            "SELECT f.inst_id, CAST(julianday(f.day) AS INTEGER) FROM archive_fail_days f "
+            "JOIN installations i ON i.id = f.inst_id WHERE f.day >= ?"
+        )
+        params = [since]
+        if community:
+            hot += " AND it.community_key = ?"
+            archived += " AND i.community_key = ?"
+            params.append(normalize_key(community))
+        # UNION: un día no cuenta dos veces aunque esté en caliente y archivado
+        return self._analytics_query(f"{hot} UNION {archived}", params * 2, [("inst", "i8"), ("day", "i8")])
+
+    def daily_totals(self, since: str, community: str = ""):
+        """
+        Conteos diarios preagregados por comunidad desde 'since' (ISO).
+        """
+        sql = (
+            "SELECT CAST(julianday(day) AS INTEGER), community_key, ok, fail, pending "
+            "FROM daily_rollup WHERE day >= ?"
+        )
+        params = [since]
+        if community:
+            sql += " AND community_key = ?"
+            params.append(normalize_key(community))
+        dtype = [("day", "i8"), ("comm", "O"), ("ok", "i8"), ("fail", "i8"), ("pending", "i8")]
+        return self._analytics_query(sql, params, dtype)
+
+    # --- planificación (escrituras directas: son pocas y se necesitan al instante) ---
+    def save_building_master(self, community: str, catalog_key: str, rows: list):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO building_masters (community_key, community, catalog_key, rows, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (normalize_key(community), community, catalog_key, json.dumps(rows, ensure_ascii=False),
+                     datetime.now().isoformat(timespec="seconds")),
+                )
+        finally:
+            conn.close()
+
+    def building_master(self, community: str):
+        """
+        (catalog_key, filas maestras) vigentes del edificio, o None si aún no tiene.
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT catalog_key, rows FROM building_masters WHERE community_key = ?", (normalize_key(community),)
+            ).fetchone()
+        finally:
+            conn.close()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def building_masters(self) -> list:
+        conn = self._connect()
+        try:
+            return [
+                (ckey, catalog_key, json.loads(rows))
+                for ckey, catalog_key, rows in conn.execute("SELECT community_key, catalog_key, rows FROM building_masters")
+            ]
+        finally:
+            conn.close()
+
+    def save_plans(self, rows: list):
+        """
+        rows: (día ISO, community_key, catalog_key, ids en JSON); se guardan en una sola transacción.
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO plan_due (day, community_key, catalog_key, item_ids) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+        finally:
+            conn.close()
+
+    def plan_for(self, community: str, day: str):
+        """
+        (catalog_key, ids de ítems) planificados para el edificio y día, o None.
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT catalog_key, item_ids FROM plan_due WHERE day = ? AND community_key = ?",
+                (day, normalize_key(community)),
+            ).fetchone()
+        finally:
+            conn.close()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def community_titles(self) -> dict:
+        conn = self._connect()
+        try:
+            return dict(conn.execute(
+                "SELECT community_key, community FROM inspections GROUP BY community_key "
+                "UNION SELECT community_key, community FROM archive_index GROUP BY community_key"
+            ))
+        finally:
+            conn.close()
+
+
+    # --- archivo ---
+    def months_before(self, day: str) -> list:
+        """
+        Meses (AAAA-MM) con inspecciones en caliente anteriores a 'day' (ISO).
+        """
+        conn = self._connect()
+        try:
+            return [m for (m,) in conn.execute(
+                "SELECT DISTINCT substr(day, 1, 7) FROM inspections WHERE day < ? ORDER BY 1", (day,)
+            )]
+        finally:
+            conn.close()
+
+    def month_inspections(self, month: str) -> list:
+        """
+        Inspecciones en caliente del mes como registros de archivo:
+        {community_key, community, day, needs, items: {key: {...}}, incidences: [...]} (ts en ISO),
+        y la revisión de cada una ({(community_key, día): rev}) leída en la misma transacción.
+        """
+        start = f"{month}-01"
+        end = date.fromordinal(date.fromisoformat(start).toordinal() + 31).replace(day=1).isoformat()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")  # las tres lecturas ven el mismo estado
+            records, revs = {}, {}
+            for ckey, day, community, needs, rev in conn.execute(
+                "SELECT community_key, day, community, needs, rev FROM inspections WHERE day >= ? AND day < ?",
+                (start, end),
+            ):
+                records[(ckey, day)] = {
+                    "community_key": ckey, "community": community, "day": day, "needs": needs,
+                    "items": {}, "incidences": [],
+                }
+                revs[(ckey, day)] = rev
+            for ckey, day, key, name, cat, task, status, note, photo in conn.execute(
+                "SELECT community_key, day, key, name, cat, task, status, note, photo FROM items "
+                "WHERE day >= ? AND day < ?",
+                (start, end),
+            ):
+                records[(ckey, day)]["items"][key] = {
+                    "name": name, "cat": cat, "task": task, "status": status, "note": note, "photo": photo,
+                }
+            for ckey, day, inc_id, employee, detail, ts in conn.execute(
+                "SELECT community_key, day, inc_id, employee, detail, ts FROM incidences "
+                "WHERE day >= ? AND day < ? ORDER BY inc_id",
+                (start, end),
+            ):
+                records[(ckey, day)]["incidences"].append(
+                    {"id": inc_id, "employee": employee, "detail": detail, "ts": ts}
+                )
+            return list(records.values()), revs
+        finally:
+            conn.close()
+
+    def archive_inspections(self, records: list, revs: dict):
+        """
+        Pasa al índice de archivo las inspecciones ya escritas en su ZIP y borra sus filas en caliente.
+        Va por la cola del escritor para no cruzarse con ediciones en curso.
+        """
+        self._queue.put(("archive", (records, revs)))
+
+    def _apply_archive(self, conn, records, revs):
+        for rec in records:
+            ckey, day = rec["community_key"], rec["day"]
+            row = conn.execute(
+                "SELECT rev FROM inspections WHERE community_key = ? AND day = ?", (ckey, day)
+            ).fetchone()
+            if row is None or row[0] != revs.get((ckey, day)):
+                continue  # cambió mientras se archivaba: queda en caliente hasta la próxima pasada
+
+            # índice liviano: búsqueda y días con FALLA (lo demás ya está en los conteos preagregados)
+            conn.execute("DELETE FROM archive_search WHERE community_key = ? AND day = ?", (ckey, day))
+            conn.executemany(
+                "INSERT INTO archive_search (kind, community_key, community, day, name, task, note, employee, detail) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [("item", ckey, rec["community"], day, it["name"], it["task"] or "", it["note"], "", "")
+                 for it in rec["items"].values()]
+                + [("incidence", ckey, rec["community"], day, "", "", "", inc["employee"], inc["detail"])
+                   for inc in rec["incidences"]],
+            )
+            conn.execute(
+                "DELETE FROM archive_fail_days WHERE day = ? AND inst_id IN "
+                "(SELECT id FROM installations WHERE community_key = ?)",
+                (day, ckey),
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO archive_fail_days (inst_id, day) "
+                "SELECT id, ? FROM installations WHERE community_key = ? AND key = ?",
+                [(day, ckey, key) for key, it in rec["items"].items() if it["status"] == "fail"],
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO archive_index (community_key, day, community, month, items, fail, photos, statuses) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (ckey, day, rec["community"], day[:7], len(rec["items"]),
+                 sum(it["status"] == "fail" for it in rec["items"].values()),
+                 sum(bool(it["photo"]) for it in rec["items"].values()),
+                 json.dumps({k: it["status"] for k, it in rec["items"].items()})),
+            )
+
+            conn.execute(
+                "DELETE FROM search WHERE rowid IN (SELECT id FROM items WHERE community_key = ? AND day = ?)",
+                (ckey, day),
+            )
+            conn.execute(
+                "DELETE FROM search WHERE rowid IN (SELECT -id FROM incidences WHERE community_key = ? AND day = ?)",
+                (ckey, day),
+            )
+            for table in ("items", "incidences", "inspections", "plan_due"):
+                conn.execute(f"DELETE FROM {table} WHERE community_key = ? AND day = ?", (ckey, day))
+
+    def archived_month(self, community_key: str, day: str):
+        """
+        Mes del ZIP donde está archivada la inspección, o None.
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT month FROM archive_index WHERE community_key = ? AND day = ?", (community_key, day)
+            ).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def prune_plans(self, before_day: str):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM plan_due WHERE day < ?", (before_day,))
+        finally:
+            conn.close()
+
+    def photo_refs(self) -> set:
+        """
+        Fotos referenciadas por ítems en caliente.
+        """
+        conn = self._connect()
+        try:
+            return {ref for (ref,) in conn.execute("SELECT DISTINCT photo FROM items WHERE photo IS NOT NULL")}
+        finally:
+            conn.close()
+
+
+# ---------------------------
+# Archivo (almacenamiento frío por mes)
+# ---------------------------
+def archive_photo(data: bytes) -> bytes:
+    """
+    Foto en calidad de archivo: JPEG de lado mayor ARCHIVE_PHOTO_MAX_PX.
+    Si no se puede leer o no queda más liviana, se conserva la original.
+    """
+    # Pillow sólo se necesita aquí: el resto del almacenamiento (y sus pruebas) no lo importa
+    from PIL import Image
+
+    try:
+        img = Image.open(BytesIO(data)).convert("RGB")
+        img.thumbnail((ARCHIVE_PHOTO_MAX_PX, ARCHIVE_PHOTO_MAX_PX))
+        buf = BytesIO()
+        img.save(buf, format="JPEG", quality=ARCHIVE_PHOTO_QUALITY, optimize=True)
+        img.close()
+    except Exception:
+        return data
+    small = buf.getvalue()
+    return small if len(small) < len(data) else data
+
+
+def merge_archived(base: dict, top: dict) -> dict:
+    """
+    Combina una inspección archivada ('base') con cambios posteriores de la misma fecha ('top'):
+    ítems e incidencias de 'top' reemplazan a los de 'base'; los requerimientos, si no están vacíos.
+    """
+    incidences = {inc["id"]: inc for inc in base["incidences"]}
+    incidences.update({inc["id"]: inc for inc in top["incidences"]})
+    return {
+        **base,
+        **top,
+        "needs": top["needs"] or base["needs"],
+        "items": {**base["items"], **top["items"]},
+        "incidences": sorted(incidences.values(), key=lambda inc: inc["id"]),
+    }
+
+
+class ArchiveStore:
+    """
+    Almacenamiento frío: un ZIP por mes (AAAA-MM.zip) con cada inspección en JSON comprimido
+    (<día>/<comunidad>.json) y sus fotos en calidad de archivo, una vez cada una (photos/<sha256>).
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, month: str) -> Path:
+        return self.root / f"{month}.zip"
+
+    @staticmethod
+    def _member(community_key: str, day: str) -> str:
+        return f"{day}/{community_key}.json"
+
+    def write_month(self, month: str, records: list, photos: PhotoStore) -> list:
+        """
+        Agrega las inspecciones al ZIP del mes y recomprime sus fotos. Una fecha que ya estaba
+        archivada se reemplaza: al reabrirla volvió completa al historial en caliente (ver
+        HistoryStore._unarchive). El ZIP se reescribe aparte y se reemplaza al final.
+        Retorna los registros tal como quedaron archivados.
+        """
+        path = self.path(month)
+        old = zipfile.ZipFile(path) if path.exists() else None
+        old_names = set(old.namelist()) if old else set()
+        tmp = path.with_name(f"{month}.{uuid.uuid4().hex}.tmp")
+        written, refs, archived = set(), {}, []
+
+        def archive_ref(ref):
+            if not ref:
+                return None
+            if ref not in refs:
+                data = None if f"photos/{ref}" in old_names else photos.get(ref)
+                if data is None:
+                    # ya archivada (se copia con el resto del ZIP anterior) o perdida
+                    refs[ref] = ref if f"photos/{ref}" in old_names else None
+                else:
+                    small = archive_photo(data)
+                    refs[ref] = hashlib.sha256(small).hexdigest()
+                    name = f"photos/{refs[ref]}"
+                    if name not in written and name not in old_names:
+                        out.writestr(name, small, compress_type=zipfile.ZIP_STORED)
+                        written.add(name)
+            return refs[ref]
+
+        try:
+            with zipfile.ZipFile(tmp, "w") as out:
+                for rec in records:
+                    rec = {**rec, "items": {k: {**it, "photo": archive_ref(it["photo"])} for k, it in rec["items"].items()}}
+                    name = self._member(rec["community_key"], rec["day"])
+                    out.writestr(
+                        name,
+                        json.dumps(rec, ensure_ascii=False, separators=(",", ":")),
+                        compress_type=zipfile.ZIP_DEFLATED,
+                    )
+                    written.add(name)
+                    archived.append(rec)
+
+                for info in old.infolist() if old else []:
+                    if info.filename not in written:
+                        copy = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                        copy.compress_type = info.compress_type
+                        with old.open(info) as src, out.open(copy, "w") as dst:
+                            shutil.copyfileobj(src, dst)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        finally:
+            if old:
+                old.close()
+        os.replace(tmp, path)
+        return archived
+
+    def read_inspection(self, month: str, community_key: str, day: str, photos: PhotoStore):
+        """
+        Estado de una inspección archivada (mismo formato que HistoryStore.load_inspection), o None.
+        Sus fotos se devuelven al almacén en caliente para poder mostrarla y volver a generar el informe.
+        """
+        try:
+            with zipfile.ZipFile(self.path(month)) as zf:
+                rec = json.loads(zf.read(self._member(community_key, day)))
+                for it in rec["items"].values():
+                    if it["photo"] and not photos.has(it["photo"]):
+                        try:
+                            with zf.open(f"photos/{it['photo']}") as src:
+                                photos.put_stream(src)
+                        except KeyError:
+                            it["photo"] = None
+        except (OSError, KeyError, zipfile.BadZipFile):
+            logger.exception("No se pudo leer la inspección archivada %s %s (%s).", community_key, day, month)
+            return None
+        return {
+            "needs": rec["needs"],
+            "items": rec["items"],
+            "incidences": [{**inc, "ts": datetime.fromisoformat(inc["ts"])} for inc in rec["incidences"]],
+        }
+
+
+def archive_old_inspections(history: HistoryStore, archive: ArchiveStore, photos: PhotoStore,
+                            today: date, after_days: int) -> dict:
+    """
+    Archiva los meses completos anteriores a (today - after_days): ZIP del mes en el archivo,
+    índice liviano en el historial, y luego borra filas y fotos en caliente que ya no se usan.
+    Se puede repetir: las fechas de un mes archivado que se volvieron a editar reemplazan las de su ZIP.
+    """
+    cutoff = date.fromordinal(today.toordinal() - after_days).replace(day=1).isoformat()
+
+    history.flush()
+    months = history.months_before(cutoff)
+    inspections = 0
+    for month in months:
+        hot, revs = history.month_inspections(month)
+        records = archive.write_month(month, hot, photos)
+        history.archive_inspections(records, revs)
+        inspections += len(records)
+    history.flush()
+    history.prune_plans(cutoff)
+
+    removed = photos.remove_unreferenced(history.photo_refs(), ARCHIVE_PHOTO_GRACE_SECONDS)
+    return {"months": months, "inspections": inspections, "photos_removed": removed}
+
@@ -0,0 +1,114 @@
+import math
+from datetime import date, timedelta
+
+import numpy as np
+
+from analytics import JULIAN_DAY_OFFSET, compute_failure_analytics
+
+INST_DTYPE = [("id", "i8"), ("comm", "O"), ("name", "O"), ("cat", "O"), ("ok", "i8"), ("fail", "i8")]
+FAIL_DTYPE = [("inst", "i8"), ("day", "i8")]
+DAILY_DTYPE = [("day", "i8"), ("comm", "O"), ("ok", "i8"), ("fail", "i8"), ("pending", "i8")]
+
+START = date(2024, 7, 1)
+
+
+def jd(offset: int) -> int:
+    return (START + timedelta(days=offset)).toordinal() + JULIAN_DAY_OFFSET
+
+
+def insts(*rows):
+    return np.array(list(rows), dtype=INST_DTYPE)
+
+
+def fails(*rows):
+    return np.array([(inst, jd(day)) for inst, day in rows], dtype=FAIL_DTYPE)
+
+
+def daily(*rows):
+    return np.array([(jd(day), comm, ok, fail, 0) for day, comm, ok, fail in rows], dtype=DAILY_DTYPE)
+
+
+def by_name(result):
+    table = result["installations"]
+    return {name: {k: v[i] for k, v in table.items()} for i, name in enumerate(table["Instalación"])}
+
+
+def test_no_history_returns_none():
+    assert compute_failure_analytics(insts(), fails(), daily(), {}) is None
+
+
+def test_history_without_failures():
+    result = compute_failure_analytics(
+        insts((1, "edif sol", "Piscina", "Comunes", 5, 0)),
+        fails(),
+        daily(*[(d, "edif sol", 1, 0) for d in range(5)]),
+        {"edif sol": "Edif Sol"},
+    )
+
+    assert result["checks"] == 5
+    assert result["fails"] == 0
+    assert result["episodes"] == 0
+    row = by_name(result)["Piscina"]
+    assert math.isnan(row["MTBF (días)"])
+    assert row["Racha máx."] == 0
+    assert row["Racha actual"] == 0
+    assert row["Comunidad"] == "Edif Sol"
+    assert result["trend"]["Tasa falla %"] == [0.0] * 5
+
+
+def test_single_run_reaching_last_day():
+    result = compute_failure_analytics(
+        insts((1, "edif sol", "Sala de Bombas", "Críticos", 2, 3)),
+        fails((1, 2), (1, 3), (1, 4)),
+        daily(*[(d, "edif sol", int(d < 2), int(d >= 2)) for d in range(5)]),
+        {},
+    )
+
+    assert result["episodes"] == 1
+    row = by_name(result)["Sala de Bombas"]
+    assert math.isnan(row["MTBF (días)"])
+    assert row["Racha máx."] == 3
+    assert row["Racha actual"] == 3
+    assert row["Tasa falla %"] == 60.0
+    assert result["trend"]["Día"][0] == START
+
+
+def test_multiple_buildings():
+    result = compute_failure_analytics(
+        insts(
+            (10, "edif sol", "Sala de Bombas", "Críticos", 6, 4),
+            (11, "edif sol", "Piscina", "Comunes", 10, 0),
+            (20, "torre mar", "Generador", "Críticos", 4, 2),
+        ),
+        # Bombas: episodios que empiezan los días 0, 3 y 6 (el último de 2 días); Generador: días 1 y 9
+        fails((10, 0), (10, 3), (10, 6), (10, 7), (20, 1), (20, 9)),
+        daily(*[(d, c, 1, 0) for d in range(10) for c in ("edif sol", "torre mar")]),
+        {"edif sol": "Edif Sol", "torre mar": "Torre Mar"},
+    )
+
+    assert result["episodes"] == 5
+    rows = by_name(result)
+    assert rows["Sala de Bombas"]["MTBF (días)"] == 3.0
+    assert rows["Sala de Bombas"]["Racha máx."] == 2
+    assert rows["Sala de Bombas"]["Racha actual"] == 0   # la última falla fue el día 7 y hay datos hasta el 9
+    assert rows["Generador"]["MTBF (días)"] == 8.0
+    assert rows["Generador"]["Racha actual"] == 1
+    assert math.isnan(rows["Piscina"]["MTBF (días)"])
+
+    assert result["installations"]["Instalación"][0] == "Sala de Bombas"
+    assert result["buildings"]["Comunidad"] == ["Torre Mar", "Edif Sol"]
+    assert result["buildings"]["Fallas"] == [2, 4]
+    categories = dict(zip(result["categories"]["Tipo"], result["categories"]["Fallas"]))
+    assert categories == {"Comunes": 0, "Críticos": 6}
+
+
+def test_top_n_limits_installations():
+    result = compute_failure_analytics(
+        insts(*[(i, "edif sol", f"Inst {i}", "Infra", 1, i % 2) for i in range(1, 6)]),
+        fails(),
+        daily((0, "edif sol", 3, 2)),
+        {},
+        top_n=2,
+    )
+
+    assert len(result["installations"]["Instalación"]) == 2
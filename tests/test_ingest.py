@@ -0,0 +1,162 @@
+import json
+import re
+import threading
+import time
+from datetime import date, datetime
+from http.client import HTTPConnection
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from ingest import make_ingest_handler, parse_ingest_batch
+from planning import MasterCache
+from shared import SharedStore
+from storage import HistoryStore, PhotoStore
+
+DAY = date(2024, 3, 4)  # lunes
+CATALOG = MasterCache().catalog_for_rows([
+    {"Tipo": "Críticos", "Instalación": "Sala de Bombas", "Frecuencia": "Diaria"},
+    {"Tipo": "Críticos", "Instalación": "Generador", "Frecuencia": "Semanal"},
+    {"Tipo": "Comunes", "Instalación": "Piscina"},
+])
+
+
+def make_store(tmp_path):
+    history = HistoryStore(tmp_path / "historial.db")
+    return SharedStore(PhotoStore(tmp_path / "photos"), history, catalog_for=lambda community: CATALOG)
+
+
+def batch(**items):
+    return parse_ingest_batch({
+        "community": "Edif Sol",
+        "date": DAY.isoformat(),
+        "items": [{"Instalación": name, "status": status} for name, status in items.items()],
+    })
+
+
+def test_parse_ingest_batch_normalizes():
+    parsed = parse_ingest_batch({
+        "comunidad": " Edif Sol ",
+        "date": "2024-03-04",
+        "items": [
+            {"Instalación": "Sala de  Bombas", "status": "Falla"},
+            {"instalacion": "sala de bombas", "note": " goteo "},
+        ],
+        "incidencias": [{"employee": "Ana", "detail": "atraso", "ts": "2024-03-04T08:30:00"}],
+    })
+
+    assert parsed["community"] == "Edif Sol"
+    assert parsed["date"] == DAY
+    # la última actualización de cada instalación gana, campo a campo
+    assert parsed["items"] == {"sala de bombas": {"name": "sala de bombas", "status": "fail", "note": "goteo"}}
+    assert parsed["incidences"] == [{"employee": "Ana", "detail": "atraso", "ts": datetime(2024, 3, 4, 8, 30)}]
+
+
+@pytest.mark.parametrize("raw, message", [
+    ([], "objeto JSON"),
+    ({"items": []}, "community"),
+    ({"community": "Edif Sol", "date": "04/03/2024"}, "'date'"),
+    ({"community": "Edif Sol", "items": {"Piscina": "ok"}}, "listas"),
+    ({"community": "Edif Sol", "items": [{"status": "ok"}]}, "items[1]: falta"),
+    ({"community": "Edif Sol", "items": [{"Instalación": "Piscina", "status": "roto"}]}, "estado inválido"),
+    ({"community": "Edif Sol", "items": [{"Instalación": "Piscina", "photo": "no es base64"}]}, "base64"),
+    ({"community": "Edif Sol", "incidences": [{"employee": "Ana"}]}, "incidences[1]"),
+    ({"community": "Edif Sol", "incidences": [{"employee": "Ana", "detail": "x", "ts": "ayer"}]}, "'ts'"),
+])
+def test_parse_ingest_batch_rejects_invalid(raw, message):
+    with pytest.raises(ValueError, match=re.escape(message)):
+        parse_ingest_batch(raw)
+
+
+def test_same_key_is_applied_once_and_replayed(tmp_path):
+    store = make_store(tmp_path)
+
+    first = store.ingest([batch(Piscina="fail")], ["bms-1"])[0]
+    again = store.ingest([batch(Piscina="ok")], ["bms-1"])[0]
+
+    assert "replayed" not in first
+    assert again == {**first, "replayed": True}
+    assert store.inspection("Edif Sol", DAY).snapshot()["items"]["piscina"]["status"] == "fail"
+
+
+def test_replay_survives_a_restart(tmp_path):
+    store = make_store(tmp_path)
+    first = store.ingest([batch(Piscina="fail")], ["bms-1"])[0]
+    store.history.flush()
+
+    restarted = make_store(tmp_path)
+    again = restarted.ingest([batch(Piscina="ok")], ["bms-1"])[0]
+
+    assert again == {**first, "replayed": True}
+    restarted.history.flush()
+    assert restarted.history.load_inspection("edif sol", DAY.isoformat())["items"]["piscina"]["status"] == "fail"
+
+
+def test_concurrent_requests_with_same_key_apply_once(monkeypatch, tmp_path):
+    store = make_store(tmp_path)
+    applied = []
+    apply_batch = store._apply_batch
+
+    def slow_apply(b):
+        applied.append(b)
+        time.sleep(0.1)
+        return apply_batch(b)
+
+    monkeypatch.setattr(store, "_apply_batch", slow_apply)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.extend(store.ingest([batch(Piscina="fail")], ["bms-1"])))
+        for _ in range(4)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(applied) == 1
+    assert sum(1 for r in results if r.get("replayed")) == 3
+
+
+@pytest.fixture
+def api(tmp_path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_ingest_handler(make_store(tmp_path)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server.server_address
+    server.shutdown()
+    server.server_close()
+
+
+def post(address, body: bytes, headers: dict):
+    conn = HTTPConnection(*address, timeout=5)
+    try:
+        conn.putrequest("POST", "/api/inspecciones")
+        for name, value in headers.items():
+            conn.putheader(name, value)
+        conn.endheaders(body)
+        resp = conn.getresponse()
+        return resp.status, json.loads(resp.read())
+    finally:
+        conn.close()
+
+
+def test_handler_rejects_bad_content_length(api):
+    status, payload = post(api, b"{}", {"Content-Length": "dos"})
+
+    assert status == 400 and "Content-Length" in payload["error"]
+
+
+def test_handler_rejects_unknown_and_not_due_items(api):
+    body = {"community": "Edif Sol", "date": DAY.isoformat(), "items": [{"Instalación": "Ascensor", "status": "ok"}]}
+    data = json.dumps(body).encode()
+    status, payload = post(api, data, {"Content-Length": str(len(data))})
+    assert (status, payload["unknown"]) == (400, ["Ascensor"])
+
+    body = {"community": "Edif Sol", "date": "2024-03-05", "items": [{"Instalación": "Generador", "status": "ok"}]}
+    data = json.dumps(body).encode()
+    status, payload = post(api, data, {"Content-Length": str(len(data))})
+    assert (status, payload["not_due"]) == (400, ["Generador"])
+
+    body["date"] = DAY.isoformat()
+    data = json.dumps(body).encode()
+    status, payload = post(api, data, {"Content-Length": str(len(data)), "Idempotency-Key": "bms-1"})
+    assert status == 202 and payload["accepted"][0]["items"] == 1  # el lunes sí toca
@@ -0,0 +1,90 @@
+from datetime import date
+
+import pytest
+
+from planning import (
+    DEFAULT_INSTALLATIONS, PLAN_HORIZON_DAYS, MasterCache, Planner, is_due, map_frecuencia,
+)
+from storage import HistoryStore
+
+MONDAY = date(2024, 3, 4)
+TUESDAY = date(2024, 3, 5)
+FIRST = date(2024, 3, 1)  # viernes
+
+ROWS = [
+    {"Tipo": "Críticos", "Instalación": "Sala de Bombas", "Frecuencia": "Diaria"},
+    {"Tipo": "Críticos", "Instalación": "Generador", "Frecuencia": "Semanal"},
+    {"Tipo": "Críticos", "Instalación": "PEAS", "Frecuencia": "Mensual"},
+]
+
+
+@pytest.fixture
+def history(tmp_path):
+    return HistoryStore(tmp_path / "historial.db")
+
+
+@pytest.fixture
+def planner(history):
+    return Planner(history, MasterCache())
+
+
+def names(checklist):
+    return [it["name"] for it in checklist]
+
+
+@pytest.mark.parametrize("raw, freq", [
+    ("Semanal", "Semanal"),
+    (" semanalmente ", "Semanal"),
+    ("Weekly", "Semanal"),
+    ("MENSUAL", "Mensual"),
+    ("monthly", "Mensual"),
+    ("Diaria", "Diaria"),
+    ("", "Diaria"),
+    (None, "Diaria"),
+    ("cada tanto", "Diaria"),
+])
+def test_map_frecuencia(raw, freq):
+    assert map_frecuencia(raw) == freq
+
+
+def test_is_due():
+    assert all(is_due("Diaria", d) for d in (MONDAY, TUESDAY, FIRST))
+    assert is_due("Semanal", MONDAY) and not is_due("Semanal", TUESDAY) and not is_due("Semanal", FIRST)
+    assert is_due("Mensual", FIRST) and not is_due("Mensual", MONDAY)
+
+
+def test_building_without_master_uses_defaults_and_saves_nothing(planner, history):
+    checklist = planner.day_checklist("Comunidad (sin nombre)", TUESDAY)
+
+    assert checklist.catalog is planner.default_catalog()
+    assert planner.building_catalog("Edif Sool") is planner.default_catalog()
+    daily = [r["Instalación"] for r in DEFAULT_INSTALLATIONS if r["Frecuencia"] == "Diaria"]
+    assert names(checklist) == daily
+    assert history.building_masters() == []
+    assert history.plan_for("Comunidad (sin nombre)", TUESDAY.isoformat()) is None
+    assert planner.plan_days(MONDAY) == 0
+
+
+def test_save_master_plans_the_horizon(planner, history):
+    catalog = planner.cache.catalog_for_rows(ROWS)
+    planner.save_master("  Edif   Sol ", catalog, FIRST)
+
+    assert history.building_master("edif sol") == (catalog.key, catalog.rows())
+    assert planner.building_catalog("Edif Sol") is catalog
+    assert history.plan_for("Edif Sol", FIRST.isoformat()) == (catalog.key, [1, 3])
+    assert names(planner.day_checklist("Edif Sol", MONDAY)) == ["Sala de Bombas", "Generador"]
+    assert names(planner.day_checklist("Edif Sol", TUESDAY)) == ["Sala de Bombas"]
+    assert planner.plan_days(FIRST) == PLAN_HORIZON_DAYS
+
+
+def test_day_checklist_replans_days_outside_or_stale(planner, history):
+    old = planner.cache.catalog_for_rows(ROWS[:1])
+    planner.save_master("Edif Sol", old, FIRST)
+    new = planner.cache.catalog_for_rows(ROWS)
+    history.save_building_master("Edif Sol", new.key, new.rows())  # plan vigente con el catálogo anterior
+    later = date(2024, 4, 1)  # fuera del horizonte, lunes y día 1
+
+    assert names(planner.day_checklist("Edif Sol", MONDAY)) == ["Sala de Bombas", "Generador"]
+    assert names(planner.day_checklist("Edif Sol", later)) == ["Sala de Bombas", "Generador", "PEAS"]
+    assert history.plan_for("Edif Sol", MONDAY.isoformat()) == (new.key, [1, 2])
+    assert history.plan_for("Edif Sol", later.isoformat()) == (new.key, [1, 2, 3])
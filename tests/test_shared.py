@@ -0,0 +1,96 @@
+from datetime import date, datetime
+
+import pytest
+
+from shared import SharedInspection, SharedStore
+from storage import HistoryStore, PhotoStore
+
+DAY = date(2024, 3, 4)
+
+
+@pytest.fixture
+def history(tmp_path):
+    return HistoryStore(tmp_path / "historial.db")
+
+
+@pytest.fixture
+def insp(history):
+    return SharedInspection("edif sol", DAY.isoformat(), "Edif Sol", history)
+
+
+def test_writes_on_different_fields_merge(insp):
+    version, current, conflicts = insp.write_item("piscina", "Piscina", {"status": "ok"}, 0, "a")
+    assert (version, conflicts) == (1, [])
+
+    # b no vio el cambio de a, pero toca otro campo: se fusiona y recibe el estado vigente
+    version, current, conflicts = insp.write_item("piscina", "Piscina", {"note": "pH 7.4"}, 0, "b")
+    assert (version, conflicts) == (2, [])
+    assert current == {"status": "ok", "note": "pH 7.4", "photo": None}
+
+
+def test_stale_write_on_same_field_is_a_conflict(insp):
+    insp.write_item("piscina", "Piscina", {"status": "ok"}, 0, "a")
+
+    version, current, conflicts = insp.write_item("piscina", "Piscina", {"status": "fail", "note": "turbia"}, 0, "b")
+
+    assert conflicts == ["status"]
+    assert current == {"status": "ok", "note": "turbia", "photo": None}
+    # con la versión vigente (y sus valores) ya no hay conflicto
+    _, current, conflicts = insp.write_item("piscina", "Piscina", {"status": "fail"}, version, "b")
+    assert (current["status"], conflicts) == ("fail", [])
+
+
+def test_unversioned_writes_always_apply(insp):
+    insp.write_item("piscina", "Piscina", {"status": "ok"}, 0, "a")
+
+    _, current, conflicts = insp.write_item("piscina", "Piscina", {"status": "fail"}, None, "api")
+
+    assert (current["status"], conflicts) == ("fail", [])
+
+
+def test_needs_conflict(insp):
+    assert insp.write_needs("luminarias", 0, "a") == (1, "luminarias", False)
+    assert insp.write_needs("repuestos", 0, "b") == (1, "luminarias", True)
+    assert insp.write_needs("repuestos", 1, "b") == (2, "repuestos", False)
+
+
+def test_changes_since_returns_deltas_in_order(insp):
+    insp.write_item("piscina", "Piscina", {"status": "ok"}, 0, "a")
+    inc = insp.add_incidence("Ana", "atraso", datetime(2024, 3, 4, 8), "b")
+    insp.delete_incidence(inc["id"], "b")
+
+    seq, deltas = insp.changes_since(1)
+
+    assert seq == 3
+    assert [(d["kind"], d["by"]) for d in deltas] == [("inc_add", "b"), ("inc_del", "b")]
+    assert insp.changes_since(3) == (3, [])
+
+
+def test_changes_since_outside_feed_window_asks_for_snapshot(monkeypatch, insp):
+    monkeypatch.setattr("shared.SHARED_FEED_MAX", 2)
+    for n in range(6):
+        insp.write_item("piscina", "Piscina", {"note": f"lectura {n}"}, None, "api")
+
+    seq, deltas = insp.changes_since(0)
+    assert (seq, deltas) == (6, None)
+    _, deltas = insp.changes_since(5)
+    assert [d["fields"] for d in deltas] == [{"note": "lectura 5"}]
+
+
+def test_store_reloads_evicted_inspection_from_history(monkeypatch, tmp_path, history):
+    store = SharedStore(PhotoStore(tmp_path / "photos"), history, catalog_for=None)
+    first = store.inspection("Edif  Sol", DAY)
+    first.write_item("piscina", "Piscina", {"status": "fail"}, 0, "a")
+    first.write_needs("luminarias", 0, "a")
+    history.flush()
+    assert store.inspection("edif sol", DAY) is first
+
+    monkeypatch.setattr("shared.SHARED_IDLE_SECONDS", 0)
+    store._last_sweep = 0
+    store.inspection("Torre Mar", DAY)  # abrir otra barre las inactivas
+    again = store.inspection("Edif Sol", DAY)
+
+    assert again is not first and again.epoch != first.epoch
+    snap = again.snapshot()
+    assert snap["items"]["piscina"]["status"] == "fail"
+    assert snap["needs"] == "luminarias"
@@ -0,0 +1,254 @@
+import hashlib
+import json
+import sqlite3
+import time
+import zipfile
+from datetime import date, datetime
+
+import pytest
+
+from storage import ArchiveStore, HistoryStore, PhotoStore, archive_old_inspections, merge_archived
+
+DAY = "2024-03-04"
+TS = datetime(2024, 3, 4, 8, 30)
+
+
+@pytest.fixture
+def photos(tmp_path):
+    return PhotoStore(tmp_path / "photos")
+
+
+@pytest.fixture
+def archive(tmp_path):
+    return ArchiveStore(tmp_path / "archive")
+
+
+@pytest.fixture
+def history(tmp_path, archive, photos):
+    return HistoryStore(tmp_path / "historial.db", archive, photos)
+
+
+def item(name, status="ok", note="", photo=None):
+    return {"name": name, "cat": "Críticos", "task": "Revisión", "status": status, "note": note, "photo": photo}
+
+
+def record(history, community, day, items, incidences=(), needs=""):
+    for it in items:
+        history.record_item(community, day, it["name"].lower(), it)
+    for inc in incidences:
+        history.record_incidence(community, day, inc)
+    if needs:
+        history.record_needs(community, day, needs)
+    history.flush()
+
+
+def rollup(history, day, community_key="edif sol"):
+    conn = history._connect()
+    try:
+        return conn.execute(
+            "SELECT ok, fail, pending FROM daily_rollup WHERE day = ? AND community_key = ?", (day, community_key)
+        ).fetchone()
+    finally:
+        conn.close()
+
+
+def archive_month(history, archive, photos, month):
+    hot, revs = history.month_inspections(month)
+    history.archive_inspections(archive.write_month(month, hot, photos), revs)
+    history.flush()
+
+
+def test_photo_store_dedupes_by_hash(photos):
+    ref = photos.put(b"foto")
+
+    assert ref == hashlib.sha256(b"foto").hexdigest()
+    assert photos.put(b"foto") == ref
+    assert photos.has(ref)
+    assert not photos.has("../" + ref)
+    assert photos.get(ref) == b"foto"
+    assert photos.remove_unreferenced({ref}, grace_seconds=0) == 0
+    assert photos.remove_unreferenced(set(), grace_seconds=0) == 1
+    assert photos.get(ref) is None
+
+
+def test_item_writes_keep_rollups_and_search(history):
+    record(history, "Edif Sol", DAY, [item("Sala de Bombas", "fail", "filtración en la válvula"), item("Piscina")])
+    record(history, "Edif Sol", DAY, [item("Sala de Bombas", "ok", "válvula reparada")])
+
+    assert rollup(history, DAY) == (2, 0, 0)
+    total, rows = history.search("valvula")
+    assert total == 1
+    assert rows[0]["name"] == "Sala de Bombas" and rows[0]["archived"] == 0
+
+
+def test_merge_archived_prefers_newer_copy():
+    base = {
+        "needs": "luminarias",
+        "items": {"piscina": item("Piscina"), "generador": item("Generador", "fail")},
+        "incidences": [{"id": 1, "employee": "Ana", "detail": "atraso", "ts": TS},
+                       {"id": 2, "employee": "Luis", "detail": "sin EPP", "ts": TS}],
+    }
+    top = {
+        "needs": "",
+        "items": {"generador": item("Generador", "ok")},
+        "incidences": [{"id": 2, "employee": "Luis", "detail": "sin EPP (corregido)", "ts": TS}],
+    }
+
+    merged = merge_archived(base, top)
+
+    assert merged["needs"] == "luminarias"
+    assert merged["items"]["generador"]["status"] == "ok"
+    assert merged["items"]["piscina"]["status"] == "ok"
+    assert [inc["detail"] for inc in merged["incidences"]] == ["atraso", "sin EPP (corregido)"]
+
+
+def test_write_month_stores_records_and_photos_once(monkeypatch, history, archive, photos):
+    monkeypatch.setattr("storage.archive_photo", lambda data: data)  # la recompresión (Pillow) no se prueba aquí
+    ref = photos.put(b"foto")
+    record(
+        history, "Edif Sol", DAY,
+        [item("Sala de Bombas", "fail", photo=ref), item("Piscina", photo=ref)],
+        [{"id": 1, "employee": "Ana", "detail": "atraso", "ts": TS}],
+        needs="luminarias",
+    )
+
+    hot, _ = history.month_inspections("2024-03")
+    archived = archive.write_month("2024-03", hot, photos)
+
+    with zipfile.ZipFile(archive.path("2024-03")) as zf:
+        names = zf.namelist()
+        rec = json.loads(zf.read(f"{DAY}/edif sol.json"))
+    assert sorted(names) == [f"{DAY}/edif sol.json", f"photos/{ref}"]
+    assert rec == archived[0]
+    assert rec["needs"] == "luminarias"
+    assert rec["incidences"] == [{"id": 1, "employee": "Ana", "detail": "atraso", "ts": TS.isoformat()}]
+
+    loaded = archive.read_inspection("2024-03", "edif sol", DAY, photos)
+    assert set(loaded["items"]) == {"sala de bombas", "piscina"}
+    assert loaded["incidences"][0]["ts"] == TS
+
+
+def test_apply_archive_moves_inspection_out_of_hot_tables(history, archive, photos):
+    record(history, "Edif Sol", DAY, [item("Sala de Bombas", "fail", "filtración")],
+           [{"id": 1, "employee": "Ana", "detail": "atraso", "ts": TS}])
+
+    archive_month(history, archive, photos, "2024-03")
+
+    assert history._load_hot("edif sol", DAY) is None
+    assert history.archived_month("edif sol", DAY) == "2024-03"
+    assert history.load_inspection("edif sol", DAY)["incidences"][0]["detail"] == "atraso"
+    assert rollup(history, DAY) == (0, 1, 0)
+    total, rows = history.search("filtracion")
+    assert total == 1 and rows[0]["archived"] == 1
+    assert list(history.fail_days(DAY)["day"]) == [date(2024, 3, 4).toordinal() + 1721424]
+    assert history.photo_refs() == set()
+
+
+def test_apply_archive_skips_inspections_changed_meanwhile(history, archive, photos):
+    record(history, "Edif Sol", DAY, [item("Sala de Bombas", "fail")])
+    hot, revs = history.month_inspections("2024-03")
+    records = archive.write_month("2024-03", hot, photos)
+
+    # cambia entre la lectura y la aplicación: su revisión ya no coincide
+    record(history, "Edif Sol", DAY, [item("Piscina")])
+    history.archive_inspections(records, revs)
+    history.flush()
+
+    assert history.archived_month("edif sol", DAY) is None
+    assert set(history.load_inspection("edif sol", DAY)["items"]) == {"sala de bombas", "piscina"}
+
+
+def test_editing_archived_item_adjusts_rollups_once(history, archive, photos):
+    record(history, "Edif Sol", DAY, [item("Sala de Bombas", "fail"), item("Piscina")])
+    archive_month(history, archive, photos, "2024-03")
+
+    record(history, "Edif Sol", DAY, [item("Sala de Bombas", "ok")])
+
+    assert rollup(history, DAY) == (2, 0, 0)
+    assert len(history.fail_days(DAY)) == 0
+
+
+def test_unreadable_archive_still_adjusts_rollups(tmp_path, history, archive, photos):
+    record(history, "Edif Sol", DAY, [item("Sala de Bombas", "fail"), item("Piscina")])
+    archive_month(history, archive, photos, "2024-03")
+    archive.path("2024-03").rename(tmp_path / "perdido.zip")
+
+    record(history, "Edif Sol", DAY, [item("Sala de Bombas", "ok")])
+
+    assert history.archived_month("edif sol", DAY) == "2024-03"
+    assert rollup(history, DAY) == (2, 0, 0)
+    assert len(history.fail_days(DAY)) == 0
+
+
+def test_reopened_archived_date_keeps_edits_and_deletions(history, archive, photos):
+    record(
+        history, "Edif Sol", DAY,
+        [item("Sala de Bombas", "fail", "filtración"), item("Piscina")],
+        [{"id": 1, "employee": "Ana", "detail": "atraso", "ts": TS},
+         {"id": 2, "employee": "Luis", "detail": "sin casco", "ts": TS}],
+        needs="luminarias",
+    )
+    archive_month(history, archive, photos, "2024-03")
+    assert history.load_inspection("edif sol", DAY)["needs"] == "luminarias"
+
+    # se reabre y se edita: borra una incidencia, vacía los requerimientos y repara la bomba
+    history.delete_incidence("Edif Sol", DAY, 2)
+    history.record_needs("Edif Sol", DAY, "")
+    record(history, "Edif Sol", DAY, [item("Sala de Bombas", "ok", "reparada")])
+
+    def check():
+        saved = history.load_inspection("edif sol", DAY)
+        assert saved["needs"] == ""
+        assert [inc["id"] for inc in saved["incidences"]] == [1]
+        assert {k: it["status"] for k, it in saved["items"].items()} == {"sala de bombas": "ok", "piscina": "ok"}
+        assert history.search("casco") == (0, [])
+        assert history.search("filtracion") == (0, [])
+        assert history.search("reparada")[0] == 1
+        assert rollup(history, DAY) == (2, 0, 0)
+        assert len(history.fail_days(DAY)) == 0
+
+    assert history.archived_month("edif sol", DAY) is None
+    check()
+
+    # al volver a archivar, el ZIP queda con la copia editada (no se fusiona con la anterior)
+    archive_month(history, archive, photos, "2024-03")
+    assert history.archived_month("edif sol", DAY) == "2024-03"
+    check()
+
+
+def test_archive_old_inspections_only_takes_complete_months(history, archive, photos):
+    record(history, "Edif Sol", DAY, [item("Piscina")])
+    record(history, "Edif Sol", "2024-06-10", [item("Piscina")])
+
+    summary = archive_old_inspections(history, archive, photos, date(2024, 6, 15), after_days=30)
+
+    assert summary["months"] == ["2024-03"]
+    assert summary["inspections"] == 1
+    assert history.load_inspection("edif sol", "2024-06-10") is not None
+
+
+def test_writer_drops_only_the_failing_change(history):
+    history.record_item("Edif Sol", DAY, "piscina", item("Piscina"))
+    history.record_item("Edif Sol", DAY, "generador", {"name": "Generador"})  # sin estado: falla
+    history.record_item("Edif Sol", DAY, "sala de bombas", item("Sala de Bombas", "fail"))
+    history.flush()
+
+    assert set(history.load_inspection("edif sol", DAY)["items"]) == {"piscina", "sala de bombas"}
+    assert rollup(history, DAY) == (1, 1, 0)
+
+
+def test_writer_waits_while_database_is_locked(monkeypatch, caplog, tmp_path):
+    monkeypatch.setattr("storage.HISTORY_BUSY_SECONDS", 0.05)
+    monkeypatch.setattr("storage.HISTORY_RETRY_SECONDS", 0.05)
+    history = HistoryStore(tmp_path / "bloqueada.db")
+    blocker = sqlite3.connect(tmp_path / "bloqueada.db")
+    blocker.execute("BEGIN EXCLUSIVE")
+
+    history.record_item("Edif Sol", DAY, "piscina", item("Piscina"))
+    time.sleep(0.5)  # varios reintentos con la base bloqueada
+    blocker.rollback()
+    blocker.close()
+    history.flush()
+
+    assert set(history.load_inspection("edif sol", DAY)["items"]) == {"piscina"}
+    assert "Historial bloqueado" in caplog.text